@@ -0,0 +1,86 @@
+"""Flat answer sheet folders vs the content-addressed blob store (storage.put / storage.put_file).
+
+Usage: python Benchmark/answer_sheet_blobs.py [sheets ...]    (default: 10000 100000)
+
+Every run writes the same synthetic sheets in a temporary folder, a tenth of them uploaded again
+under another question number (the same scan filed twice):
+  - flat: one file per sheet name in a single folder, like Result/handwriting/mismatched before
+  - blobs: storage.put, one file per distinct content under Result/blobs/<2>/<2>/
+and reports the write time, the files and bytes on disk, the largest folder, the time of the
+os.listdir the old mismatched view ran on every verification, and the time to migrate the flat
+folder into the store (storage.put_file, hard links). The database is not used.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import storage
+
+
+def synthetic_uploads(count, size=20000, seed=0):
+
+    # (file name, bytes) of distinct sheets, then a tenth of the scans again under another question number
+    rng = np.random.default_rng(seed)
+    uploads = [(f'ST{i // 20:05d}_sql_Q{i % 20 + 1}.jpeg', rng.bytes(size)) for i in range(count)]
+    return uploads + [(file_name.replace('_Q', '_Q10'), data) for file_name, data in uploads[::10]]
+
+
+def disk_usage(folder):
+
+    files, size, largest = 0, 0, 0
+    for path, folders, file_names in os.walk(folder):
+        files += len(file_names)
+        size += sum(os.path.getsize(os.path.join(path, i)) for i in file_names)
+        largest = max(largest, len(file_names) + len(folders))
+    return files, size, largest
+
+
+def write_flat(folder, uploads):
+    for file_name, data in uploads:
+        storage.write(os.path.join(folder, file_name), data)
+
+
+def write_blobs(uploads):
+    for _, data in uploads:
+        storage.put(data)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    sizes = [int(i) for i in sys.argv[1:]] or [10000, 100000]
+
+    print(f'{"sheets":>8} {"store":<8} {"write (s)":>10} {"files":>8} {"MB":>8} {"largest folder":>15} {"listdir (ms)":>13}')
+    for count in sizes:
+        uploads = synthetic_uploads(count)
+
+        with tempfile.TemporaryDirectory() as workspace:
+            os.chdir(workspace)
+            flat = os.path.join('Result', 'handwriting', 'mismatched')
+            os.makedirs(flat)
+
+            flat_time = timed(write_flat, flat, uploads)
+            listdir_time = timed(os.listdir, flat)
+            files, size, largest = disk_usage(flat)
+            print(f'{count:>8} {"flat":<8} {flat_time:>10.2f} {files:>8} {size / 1e6:>8.1f} {largest:>15} {listdir_time * 1000:>13.1f}')
+
+            blob_time = timed(write_blobs, uploads)
+            files, size, largest = disk_usage(storage.root)
+            print(f'{count:>8} {"blobs":<8} {blob_time:>10.2f} {files:>8} {size / 1e6:>8.1f} {largest:>15} {"-":>13}')
+
+            # Migration of the flat folder into an empty store
+            os.rename(storage.root, 'previous_blobs')
+            migrate_time = timed(lambda: [storage.put_file(os.path.join(flat, i)) for i in os.listdir(flat)])
+            print(f'{count:>8} {"migrate":<8} {migrate_time:>10.2f}')
+
+            os.chdir(os.path.dirname(workspace))
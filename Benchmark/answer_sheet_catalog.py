@@ -0,0 +1,108 @@
+"""Time to find the next answer sheet to evaluate: the previous folder scan in supersub.evaluation vs the
+answer_sheet catalog queries (catalog.next_pending).
+
+Usage: python Benchmark/answer_sheet_catalog.py [sheets ...]    (default: 1000 5000 20000)
+
+Each run creates empty sheet files for one concept in a temporary workspace, half of them already evaluated,
+and catalogs them with the migration step (migration.create_answer_sheet_catalog) in a scratch 'bench'
+schema, so the real tables are untouched. Run 'python app.py migrate' first.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sql, migration
+
+
+def create_sheets(sheets):
+
+    # 50 students per question, the even questions are already evaluated by 'evaluator1'
+    concept_path = os.path.join('Result', 'handwriting', 'matched', 'concepts', 'python')
+    evaluation_path = os.path.join('Result', 'evaluation', 'evaluator1', 'python')
+    os.makedirs(concept_path)
+    os.makedirs(evaluation_path)
+
+    for i in range(sheets):
+        file_name = f'student{i % 50}_python_Q{i // 50 + 1}.jpeg'
+        open(os.path.join(concept_path, file_name), 'w').close()
+        if (i // 50) % 2 == 1:
+            open(os.path.join(evaluation_path, file_name), 'w').close()
+
+
+def folder_scan(user_id, concept):
+
+    # The previous lookup: both folders listed, sorted by question number and compared in Python
+    evauated_answer_sheet_list = os.listdir(os.path.join('Result', 'evaluation', user_id, concept))
+    answer_sheet_list = os.listdir(os.path.join('Result', 'handwriting', 'matched', 'concepts', concept))
+    answer_sheet_list = sorted(answer_sheet_list, key=lambda x: int(x.split('_')[-1].split('.')[0].replace('Q', '')))
+    pending_evaluation_list = [i for i in answer_sheet_list if i not in evauated_answer_sheet_list]
+
+    return pending_evaluation_list[0], len(pending_evaluation_list)
+
+
+def catalog_query(cursor, user_id, concept):
+
+    sql.execute_prepared(cursor, 'next_answer_sheets', (concept, user_id, 1))
+    sheet = cursor.fetchone()
+    sql.execute_prepared(cursor, 'pending_answer_sheets', (concept, user_id))
+
+    return sheet[0], cursor.fetchone()[0]
+
+
+def best(function, repeats=5):
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+if __name__ == '__main__':
+
+    sizes = [int(i) for i in sys.argv[1:]] or [1000, 5000, 20000]
+
+    print(f'{"sheets":>8} {"folder scan (ms)":>17} {"catalog (ms)":>13} {"speedup":>8} {"backfill (s)":>13}')
+    for sheets in sizes:
+        with tempfile.TemporaryDirectory() as workspace:
+            os.chdir(workspace)
+            create_sheets(sheets)
+
+            connection = sql.get_connection()
+            cursor = connection.cursor()
+
+            try:
+                cursor.execute(f'''drop schema if exists bench cascade;''')
+                cursor.execute(f'''create schema bench;''')
+                cursor.execute(f'''set local search_path to bench;''')
+
+                start = time.perf_counter()
+                migration.create_answer_sheet_catalog(cursor)
+                cursor.execute(f'''analyze;''')
+                backfill_time = time.perf_counter() - start
+
+                scan_time, expected = best(lambda: folder_scan('evaluator1', 'python'), repeats=3)
+                query_time, result = best(lambda: catalog_query(cursor, 'evaluator1', 'python'))
+
+                # Same pending count, and a first sheet of the same (lowest pending) question
+                assert result[1] == expected[1] and result[0].split('_')[-1] == expected[0].split('_')[-1]
+
+            finally:
+                connection.rollback()
+                cursor.execute(f'''drop schema if exists bench cascade;''')
+                connection.commit()
+
+                # The statements were prepared against the scratch schema
+                cursor.execute(f'''deallocate all;''')
+                connection.prepared.clear()
+                cursor.close()
+                sql.release_connection(connection)
+
+        print(f'{sheets:>8} {scan_time * 1000:>17.1f} {query_time * 1000:>13.2f} {scan_time / query_time:>7.0f}x '
+              f'{backfill_time:>13.2f}')
@@ -0,0 +1,85 @@
+"""Per-rerun cost of showing an answer sheet on the evaluation page: the previous decode and resize of the
+original upload vs the WebP preview renditions (preview.create at ingestion, preview.load on display).
+
+Usage: python Benchmark/answer_sheet_preview.py [sheets]    (default: 20)
+
+Sheets are synthetic A4 scans at 300 dpi (2480x3508 JPEG, white paper with handwriting-like strokes) written
+to a temporary workspace; the renditions go to its Cache/previews.
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import preview
+
+
+def synthetic_sheet(path, seed):
+
+    rng = np.random.default_rng(seed)
+    image = Image.new('RGB', (2480, 3508), 'white')
+    draw = ImageDraw.Draw(image)
+
+    # Lines of short pen strokes
+    for row in range(300, 3300, 110):
+        x = 200
+        while x < 2250:
+            points = [(x + i * 6, row + rng.integers(-25, 25)) for i in range(rng.integers(4, 12))]
+            draw.line(points, fill=(20, 20, 60), width=4)
+            x = points[-1][0] + rng.integers(15, 60)
+
+    image.save(path, format='JPEG', quality=90)
+
+
+def previous_display(path):
+
+    # Image.open + resize((900, 900)) on every rerun, then st.image encodes the PIL image for the browser
+    image = Image.open(path).resize((900, 900))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=75)
+    return buffer.getvalue()
+
+
+def timed(function, paths):
+
+    start = time.perf_counter()
+    sizes = [len(function(path)) for path in paths]
+    return (time.perf_counter() - start) / len(paths) * 1000, np.mean(sizes) / 1024
+
+
+if __name__ == '__main__':
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    with tempfile.TemporaryDirectory() as workspace:
+        os.chdir(workspace)
+        paths = [f'student{i}_python_Q{i}.jpeg' for i in range(count)]
+        for i, path in enumerate(paths):
+            synthetic_sheet(path, i)
+
+        original_size = np.mean([os.path.getsize(path) for path in paths]) / 1024
+        previous_time, previous_size = timed(previous_display, paths)
+
+        start = time.perf_counter()
+        for path in paths:
+            with Image.open(path) as image:
+                preview.create(image, path)
+        ingest_time = (time.perf_counter() - start) / count * 1000
+
+        cold_time, preview_size = timed(preview.load, paths)
+        warm_time, _ = timed(preview.load, paths)
+        zoom_size = np.mean([os.path.getsize(preview.path(path, preview.widths[1])) for path in paths]) / 1024
+
+    print(f'{count} sheets, original JPEG {original_size:.0f} KB\n')
+    print(f'{"":<34} {"ms/sheet":>9} {"KB to browser":>14}')
+    print(f'{"previous: decode + resize per rerun":<34} {previous_time:>9.1f} {previous_size:>14.0f}')
+    print(f'{"preview from disk (first view)":<34} {cold_time:>9.2f} {preview_size:>14.0f}')
+    print(f'{"preview from the LRU (rerun)":<34} {warm_time:>9.3f} {preview_size:>14.0f}')
+    print(f'\nrenditions created once at ingestion: {ingest_time:.0f} ms/sheet '
+          f'({preview.widths[0]} px {preview_size:.0f} KB, {preview.widths[1]} px {zoom_size:.0f} KB)')
@@ -0,0 +1,83 @@
+"""CPU time and disk usage of storing matched answer sheets: the previous decode and two re-encoded saves
+(concept and student folder) vs writing the uploaded bytes once and hard-linking the student copy
+(storage.write / storage.link).
+
+Usage: python Benchmark/answer_sheet_storage.py [sheets]    (default: 50)
+
+Uploads are synthetic A4 scans held in memory like Streamlit uploads (see answer_sheet_preview.py),
+written to a temporary workspace.
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import storage
+from answer_sheet_preview import synthetic_sheet
+
+
+def previous(upload, concept_path, student_path):
+
+    img = Image.open(upload)
+    os.makedirs(os.path.dirname(concept_path), exist_ok=True)
+    img.save(concept_path)
+    os.makedirs(os.path.dirname(student_path), exist_ok=True)
+    img.save(student_path)
+
+
+def original_bytes(upload, concept_path, student_path):
+
+    storage.write(concept_path, upload.getvalue())
+    storage.link(concept_path, student_path)
+
+
+def disk_usage(root):
+
+    # Allocated bytes, a hard-linked file is counted once
+    inodes = {}
+    for folder, _, files in os.walk(root):
+        for file_name in files:
+            stat = os.stat(os.path.join(folder, file_name))
+            inodes[stat.st_ino] = stat.st_blocks * 512
+
+    return sum(inodes.values())
+
+
+def measure(store, uploads, root):
+
+    start = time.process_time()
+    for i, upload in enumerate(uploads):
+        upload.seek(0)
+        name = f'student{i % 10}_python_Q{i}.jpeg'
+        store(upload, os.path.join(root, 'matched', 'concepts', 'python', name),
+              os.path.join(root, 'matched', 'students', f'student{i % 10}', name))
+
+    return (time.process_time() - start) / len(uploads) * 1000, disk_usage(root) / 2 ** 20
+
+
+if __name__ == '__main__':
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    with tempfile.TemporaryDirectory() as workspace:
+        os.chdir(workspace)
+
+        uploads = []
+        for i in range(count):
+            synthetic_sheet('upload.jpeg', i)
+            with open('upload.jpeg', 'rb') as file:
+                uploads.append(io.BytesIO(file.read()))
+        upload_size = sum(len(upload.getvalue()) for upload in uploads) / 2 ** 20
+
+        previous_cpu, previous_disk = measure(previous, uploads, 'previous')
+        new_cpu, new_disk = measure(original_bytes, uploads, 'original')
+
+    print(f'{count} uploads, {upload_size:.1f} MB\n')
+    print(f'{"":<28} {"CPU ms/sheet":>13} {"disk (MB)":>10}')
+    print(f'{"decode + 2 saves (previous)":<28} {previous_cpu:>13.1f} {previous_disk:>10.1f}')
+    print(f'{"bytes + hard link":<28} {new_cpu:>13.2f} {new_disk:>10.1f}')
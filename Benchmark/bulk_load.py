@@ -0,0 +1,81 @@
+"""COPY-based bulk loading vs cursor.executemany for the student_test table.
+
+Usage: python Benchmark/bulk_load.py [rows ...]    (default: 10000 100000 1000000)
+
+Rows are loaded into a scratch copy of student_test, so the real tables are untouched.
+Run 'python app.py migrate' first so the database and tables exist.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sql
+
+
+columns = ['student_id', 'test_id', 'concept', 'question_no', 'question', 'answer', 'mark']
+
+
+def synthetic_answers(rows):
+
+    # One row per (student, question) like the data submitted by student.write_test
+    index = np.arange(rows)
+    return pd.DataFrame({'student_id': [f'student{i // 50}' for i in index],
+                         'test_id': 'test_1',
+                         'concept': 'python',
+                         'question_no': index % 50 + 1,
+                         'question': 'What is Python?',
+                         'answer': 'A programming language',
+                         'mark': index % 2})
+
+
+def executemany(cursor, df):
+    cursor.executemany(f'''insert into bench_student_test(student_id, test_id, concept, question_no, question, answer, mark)
+                           values(%s,%s,%s,%s,%s,%s,%s);''', df.values.tolist())
+
+
+def copy(cursor, df):
+    sql.bulk_load(cursor, 'bench_student_test', columns, df,
+                  key=['student_id', 'test_id', 'concept', 'question_no'])
+
+
+def measure(load, df):
+
+    connection = sql.get_connection()
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute(f'''create table if not exists bench_student_test (like student_test including all);''')
+        cursor.execute(f'''truncate bench_student_test;''')
+        connection.commit()
+
+        start = time.perf_counter()
+        load(cursor, df)
+        connection.commit()
+        elapsed = time.perf_counter() - start
+
+        cursor.execute(f'''select count(*) from bench_student_test;''')
+        assert cursor.fetchone()[0] == len(df)
+        return elapsed
+
+    finally:
+        cursor.execute(f'''drop table if exists bench_student_test;''')
+        connection.commit()
+        cursor.close()
+        sql.release_connection(connection)
+
+
+if __name__ == '__main__':
+
+    sizes = [int(i) for i in sys.argv[1:]] or [10000, 100000, 1000000]
+
+    print(f'{"rows":>10} {"executemany (s)":>16} {"copy (s)":>10} {"speedup":>8}')
+    for rows in sizes:
+        df = synthetic_answers(rows)
+        executemany_time = measure(executemany, df)
+        copy_time = measure(copy, df)
+        print(f'{rows:>10} {executemany_time:>16.2f} {copy_time:>10.2f} {executemany_time / copy_time:>7.1f}x')
@@ -0,0 +1,68 @@
+"""Nearest-centroid verification (teacher.verify_writers) vs the softmax classifier
+(teacher.predict_writers) on the labelled sheets in Dataset/Test_unknown.
+
+Usage: python Benchmark/centroid_verification.py [thresholds ...]    (default: 1.25 1.5 1.75 2 2.5)
+
+Every sheet is checked once with its true student (genuine claim) and once with each other
+student (impostor claims). Folders S1, S2, ... hold the sheets of student1, student2, ...
+Requires a trained model (Model/current.json or Model/trained_model.h5); the centroid index is built if missing.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import teacher
+
+
+def labelled_sheets(test_path):
+
+    paths, students = [], []
+    for folder in sorted(os.listdir(test_path)):
+        for file_name in sorted(os.listdir(os.path.join(test_path, folder))):
+            paths.append(os.path.join(test_path, folder, file_name))
+            students.append(f'student{folder[1:]}')
+
+    return paths, np.array(students)
+
+
+if __name__ == '__main__':
+
+    thresholds = [float(i) for i in sys.argv[1:]] or [1.25, 1.5, 1.75, 2, 2.5]
+    paths, students = labelled_sheets(os.path.join('Dataset', 'Test_unknown'))
+
+    start = time.perf_counter()
+    writers, _, _ = teacher.build_centroids()
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    teacher.enroll_centroid(writers[-1])
+    enroll_time = time.perf_counter() - start
+
+    # Genuine claims and every impostor claim of the same sheets
+    claims = [(paths, students)] + [(paths, np.array([writers[(writers.index(s) + shift) % len(writers)] for s in students]))
+                                    for shift in range(1, len(writers))]
+
+    start = time.perf_counter()
+    predicted = teacher.predict_writers(paths)
+    classifier_time = (time.perf_counter() - start) / len(paths)
+
+    print(f'{len(paths)} sheets, {len(writers)} students, centroid index built in {build_time:.1f} s, '
+          f'one student enrolled in {enroll_time:.1f} s\n')
+    print(f'{"engine":<26} {"false rejects":>14} {"false accepts":>14} {"ms/sheet":>9}')
+    print(f'{"classifier (argmax)":<26} {np.mean(predicted != students):>14.1%} '
+          f'{np.mean([np.mean(predicted == claimed) for _, claimed in claims[1:]]):>14.1%} {classifier_time * 1000:>9.1f}')
+
+    for threshold in thresholds:
+        os.environ['CENTROID_THRESHOLD'] = str(threshold)
+
+        start = time.perf_counter()
+        genuine = teacher.verify_writers(paths, students)
+        centroid_time = (time.perf_counter() - start) / len(paths)
+
+        impostor = np.concatenate([teacher.verify_writers(paths, claimed) for _, claimed in claims[1:]])
+        print(f'{f"centroid, threshold {threshold}":<26} {1 - genuine.mean():>14.1%} {impostor.mean():>14.1%} '
+              f'{centroid_time * 1000:>9.1f}')
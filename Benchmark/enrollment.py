@@ -0,0 +1,75 @@
+"""Wall time and accuracy of enrolling one new writer (teacher.enroll_writer) vs a full retrain
+(teacher.model_training).
+
+Usage: python Benchmark/enrollment.py [dataset folder] [test folder]    (default: Dataset/images Dataset/Test_unknown)
+
+Runs in a temporary workspace: a model is trained on every writer but one, then the held-out
+writer is enrolled, and a full retrain on all writers is timed for comparison. Both models are
+scored on the sheets of Dataset/Test_unknown, which neither model was trained on (folders S1, S2, ...
+hold the sheets of student1, student2, ...), overall and on the enrolled writer's sheets.
+Model/ and Cache/ of the app are untouched.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import teacher
+
+
+def labelled_sheets(test_path):
+
+    paths, students = [], []
+    for folder in sorted(os.listdir(test_path)):
+        for file_name in sorted(os.listdir(os.path.join(test_path, folder))):
+            paths.append(os.path.join(test_path, folder, file_name))
+            students.append(f'student{folder[1:]}')
+
+    return paths, np.array(students)
+
+
+def accuracy(paths, students, new_writer):
+
+    # Writer names of the saved model's predictions, so the class order does not matter
+    predicted = teacher.predict_writers(paths)
+    return np.mean(predicted == students), np.mean(predicted[students == new_writer] == new_writer)
+
+
+if __name__ == '__main__':
+
+    source = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else os.path.join('Dataset', 'images'))
+    paths, students = labelled_sheets(os.path.abspath(sys.argv[2] if len(sys.argv) > 2 else os.path.join('Dataset', 'Test_unknown')))
+    writers = sorted(os.listdir(source))
+    new_writer = writers[-1]
+
+    with tempfile.TemporaryDirectory() as workspace:
+        os.chdir(workspace)
+        data_path = os.path.join('Dataset', 'images')
+        os.makedirs(data_path)
+
+        # Model of the existing cohort
+        for writer in writers[:-1]:
+            os.symlink(os.path.join(source, writer), os.path.join(data_path, writer))
+        teacher.model_training()
+
+        # The new writer's samples arrive
+        os.symlink(os.path.join(source, new_writer), os.path.join(data_path, new_writer))
+
+        start = time.perf_counter()
+        teacher.enroll_writer(new_writer)
+        enroll_time = time.perf_counter() - start
+        enroll_accuracy = accuracy(paths, students, new_writer)
+
+        start = time.perf_counter()
+        teacher.model_training()
+        retrain_time = time.perf_counter() - start
+        retrain_accuracy = accuracy(paths, students, new_writer)
+
+    print(f'{len(writers)} writers, enrolling {new_writer}, {len(paths)} test sheets\n')
+    print(f'{"":<16} {"wall time (s)":>13} {"accuracy":>9} {f"{new_writer} sheets":>16}')
+    print(f'{"enrollment":<16} {enroll_time:>13.1f} {enroll_accuracy[0]:>9.1%} {enroll_accuracy[1]:>16.1%}')
+    print(f'{"full retrain":<16} {retrain_time:>13.1f} {retrain_accuracy[0]:>9.1%} {retrain_accuracy[1]:>16.1%}')
@@ -0,0 +1,75 @@
+"""Answer-sheet throughput of teacher.predict_writers (batched) vs one model.predict per image.
+
+Usage: python Benchmark/handwriting_inference.py [sheets ...]    (default: 10 100 1000)
+
+Sheets are synthetic grayscale JPEGs held in memory like Streamlit uploads. A trained model
+(Model/current.json or Model/trained_model.h5) is required, train one from the teacher's Model Training tab.
+"""
+
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import teacher, model_registry
+
+
+def synthetic_sheets(count):
+
+    rng = np.random.default_rng(42)
+    sheets = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, (1100, 850), dtype=np.uint8)).save(buffer, format='JPEG')
+        buffer.name = f'student{i % 6 + 1}_python_Q{i}.jpeg'
+        buffer.seek(0)
+        sheets.append(buffer)
+
+    return sheets
+
+
+def one_by_one(sheets):
+
+    # The previous per-image loop: batch of one and a label lookup for every sheet
+    model = model_registry.get()
+    writers = []
+    for sheet in sheets:
+        image = teacher.preprocess_image(sheet) / 255.0
+        writer_id = np.argmax(model.predict(np.expand_dims(image, axis=0), verbose=0))
+        writers.append(os.listdir(os.path.join('Dataset', 'images'))[writer_id])
+
+    return writers
+
+
+def batched(sheets):
+
+    return list(teacher.predict_writers(sheets, batch_size=int(os.getenv('PREDICT_BATCH_SIZE', 64))))
+
+
+if __name__ == '__main__':
+
+    sizes = [int(i) for i in sys.argv[1:]] or [10, 100, 1000]
+
+    # Load the model and warm up both paths before timing
+    batched(synthetic_sheets(2))
+    one_by_one(synthetic_sheets(2))
+
+    print(f'{"sheets":>7} {"one by one (sheets/s)":>22} {"batched (sheets/s)":>19} {"speedup":>8}')
+    for count in sizes:
+        sheets = synthetic_sheets(count)
+
+        start = time.perf_counter()
+        expected = one_by_one(sheets)
+        one_by_one_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = batched(sheets)
+        batched_time = time.perf_counter() - start
+
+        assert result == expected
+        print(f'{count:>7} {count / one_by_one_time:>22.1f} {count / batched_time:>19.1f} '
+              f'{one_by_one_time / batched_time:>7.1f}x')
@@ -0,0 +1,57 @@
+"""Training-set loading time of teacher.load_images: the sequential cv2 loop, parallel decoding
+with an empty sample cache, and a retraining run served from the cache.
+
+Usage: python Benchmark/image_loading.py [dataset folder]    (default: Dataset/images)
+
+The sample cache is written to a temporary folder, so Cache/samples is untouched.
+"""
+
+import os
+import sys
+import cv2
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import teacher
+
+
+def sequential(folder_path):
+
+    # The previous loader: one cv2.imread + cv2.resize after another, nothing kept
+    images = []
+    for file_name in os.listdir(folder_path):
+        image = cv2.imread(os.path.join(folder_path, file_name), cv2.IMREAD_GRAYSCALE)
+        try:
+            images.append(cv2.resize(image, (128, 128)))
+        except:
+            pass
+
+    return images
+
+
+def load_all(loader, data_path):
+    return [image for writer in os.listdir(data_path) for image in loader(os.path.join(data_path, writer))]
+
+
+if __name__ == '__main__':
+
+    data_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join('Dataset', 'images')
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        teacher.sample_cache = cache_dir
+
+        timings, results = {}, {}
+        for label, loader in [('sequential', sequential), ('parallel, empty cache', teacher.load_images),
+                              ('parallel, cached', teacher.load_images)]:
+            start = time.perf_counter()
+            results[label] = load_all(loader, data_path)
+            timings[label] = time.perf_counter() - start
+
+        images = results['sequential']
+        assert all((a == b).all() for result in results.values() for a, b in zip(images, result))
+
+        print(f'{len(images)} images, {teacher.image_executor()._max_workers} workers\n')
+        for label, elapsed in timings.items():
+            print(f'{label:<24} {elapsed:>7.2f} s  {timings["sequential"] / elapsed:>6.1f}x')
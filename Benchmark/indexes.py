@@ -0,0 +1,144 @@
+"""EXPLAIN ANALYZE timings of the app's student_test / student_exam / student_marks queries
+before and after the index migration (migration.create_indexes).
+
+Usage: python Benchmark/indexes.py [students]    (default: 2000)
+
+The tables are created and seeded in a scratch 'bench' schema with the same migration steps
+the app uses, so the real tables are untouched. Run 'python app.py migrate' first.
+"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sql, migration
+
+
+# (label, query, params) taken from the data-access functions in app.py
+queries = [
+    ('teacher.get_test_id_list',
+     '''select distinct test_id from student_test;''', None),
+
+    ('teacher.student_test_status (test_id)',
+     '''select student_id, test_id, concept, coalesce(sum(mark), 0) as mark
+        from student_test
+        where test_id=%s
+        group by student_id, test_id, concept
+        order by test_id, student_id, concept
+        limit 51;''', ('test_3',)),
+
+    ('student.student_test_status_verification',
+     '''select * from student_test
+        where student_id=%s and test_id=%s;''', ('student42', 'test_3')),
+
+    ('teacher.get_exam_id_list',
+     '''select distinct exam_id from student_exam;''', None),
+
+    ('teacher.query_student_exam_analytics (exam_id)',
+     '''select student_id, exam_id, concept, question_no, mark, evaluator_id,
+               avg(mark) as average_mark, max(mark) as maximum_mark,
+               grouping(evaluator_id, mark) as summary
+        from student_exam
+        where true and exam_id=%s
+        group by grouping sets ((student_id, exam_id, concept, question_no, mark, evaluator_id),
+                                (student_id, exam_id, concept, question_no));''', ('exam_2',)),
+
+    ('teacher.query_student_exam_analytics (student_id)',
+     '''select student_id, exam_id, concept, question_no, mark, evaluator_id,
+               avg(mark) as average_mark, max(mark) as maximum_mark,
+               grouping(evaluator_id, mark) as summary
+        from student_exam
+        where true and student_id=%s
+        group by grouping sets ((student_id, exam_id, concept, question_no, mark, evaluator_id),
+                                (student_id, exam_id, concept, question_no));''', ('student42',)),
+
+    ('teacher.mark_delete_student_marks_table',
+     '''delete from student_marks
+        where exam_id=%s;''', ('exam_2',)),
+
+    ('student.student_exam_status',
+     '''select * from student_marks
+        where student_id=%s;''', ('student42',)),
+]
+
+
+def seed(cursor, students):
+
+    cursor.execute(f'''insert into student_test(student_id, test_id, concept, question_no, question, answer, mark)
+                       select 'student' || s, 'test_' || t, 'python', q, 'question', 'answer', (s + q) %% 2
+                       from generate_series(1, %s) s, generate_series(1, 10) t, generate_series(1, 20) q;''',
+                   (students,))
+
+    cursor.execute(f'''insert into student_exam(student_id, exam_id, concept, question_no, mark, evaluator_id)
+                       select 'student' || s, 'exam_' || e, 'python', q, (s * q + v) %% 10, 'evaluator' || v
+                       from generate_series(1, %s) s, generate_series(1, 5) e,
+                            generate_series(1, 10) q, generate_series(1, 2) v;''', (students,))
+
+    cursor.execute(f'''insert into student_marks(student_id, exam_id, concept, question_no, mark)
+                       select 'student' || s, 'exam_' || e, 'python', q, (s * q) %% 10
+                       from generate_series(1, %s) s, generate_series(1, 5) e, generate_series(1, 10) q;''',
+                   (students,))
+
+    cursor.execute(f'''analyze;''')
+
+
+def scans(plan):
+
+    # Access paths of the plan (Seq Scan, Index Scan, Index Only Scan, Bitmap Heap Scan ...)
+    found = [plan['Node Type']] if 'Relation Name' in plan else []
+    for child in plan.get('Plans', []):
+        found += scans(child)
+    return found
+
+
+def explain(cursor):
+
+    timings = {}
+    for label, query, params in queries:
+        cursor.execute(f'''explain (analyze, format json) {query}''', params)
+        plan = cursor.fetchone()[0]
+        plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+        timings[label] = (plan['Execution Time'], ', '.join(scans(plan['Plan'])))
+
+        # Undo the delete so both runs see the same rows
+        cursor.execute(f'''rollback to savepoint explain;''')
+
+    return timings
+
+
+if __name__ == '__main__':
+
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    connection = sql.get_connection()
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute(f'''drop schema if exists bench cascade;''')
+        cursor.execute(f'''create schema bench;''')
+        cursor.execute(f'''set local search_path to bench;''')
+
+        migration.create_tables(cursor)
+        seed(cursor, students)
+        cursor.execute(f'''savepoint explain;''')
+        before = explain(cursor)
+
+        migration.create_indexes(cursor)
+        cursor.execute(f'''analyze;''')
+        cursor.execute(f'''savepoint explain;''')
+        after = explain(cursor)
+
+        print(f'{students} students: 400 student_test, 100 student_exam and 50 student_marks rows each\n')
+        print(f'{"query":<50} {"before (ms)":>12} {"after (ms)":>11}  access path before -> after')
+        for label, _, _ in queries:
+            print(f'{label:<50} {before[label][0]:>12.2f} {after[label][0]:>11.2f}  '
+                  f'{before[label][1]} -> {after[label][1]}')
+
+    finally:
+        connection.rollback()
+        cursor.execute(f'''drop schema if exists bench cascade;''')
+        connection.commit()
+        cursor.close()
+        sql.release_connection(connection)
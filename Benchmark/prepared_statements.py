@@ -0,0 +1,65 @@
+"""Per-call latency of the hot single-row lookups: f-string SQL vs the prepared statements
+of sql.execute_prepared.
+
+Usage: python Benchmark/prepared_statements.py [calls]    (default: 5000)
+
+Both variants run on one pooled connection against the existing tables (read-only).
+Run 'python app.py migrate' first so the database, the default admin and the status row exist.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sql
+
+
+# (statement name, params, f-string SQL as built before the registry)
+lookups = [
+    ('login_password', ('admin', 'admin'),
+     '''select password from login_credentials
+        where user_id='admin' and role like 'admin%';'''),
+
+    ('user_role', ('admin',),
+     '''select role from login_credentials
+        where user_id='admin';'''),
+
+    ('portal_status', ('upload_portal',),
+     '''select status from status
+        where identifier='upload_portal';'''),
+
+    ('student_test_answers', ('student1', 'test_1'),
+     '''select * from student_test
+        where student_id='student1' and test_id='test_1';'''),
+]
+
+
+def measure(cursor, call, calls):
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        call()
+        cursor.fetchall()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+if __name__ == '__main__':
+
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    connection = sql.get_connection()
+    cursor = connection.cursor()
+
+    try:
+        print(f'{"statement":<22} {"f-string (us)":>14} {"prepared (us)":>14} {"speedup":>8}')
+        for name, params, query in lookups:
+            adhoc = measure(cursor, lambda: cursor.execute(query), calls)
+            prepared = measure(cursor, lambda: sql.execute_prepared(cursor, name, params), calls)
+            print(f'{name:<22} {adhoc:>14.1f} {prepared:>14.1f} {adhoc / prepared:>7.2f}x')
+
+    finally:
+        connection.rollback()
+        cursor.close()
+        sql.release_connection(connection)
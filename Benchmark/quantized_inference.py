@@ -0,0 +1,80 @@
+"""Size, load time, per-sheet latency and accuracy parity of the quantized TFLite exports
+(teacher.export_quantized) against the float32 Keras model on Dataset/Test_unknown.
+
+Usage: python Benchmark/quantized_inference.py [repeats]    (default: 5)
+
+Folders S1, S2, ... of Dataset/Test_unknown hold the sheets of student1, student2, ...
+Requires a trained model (Model/current.json or Model/trained_model.h5); the float16 and int8 exports are rebuilt.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import teacher, model_registry
+
+
+def labelled_sheets(test_path):
+
+    paths, students = [], []
+    for folder in sorted(os.listdir(test_path)):
+        for file_name in sorted(os.listdir(os.path.join(test_path, folder))):
+            paths.append(os.path.join(test_path, folder, file_name))
+            students.append(f'student{folder[1:]}')
+
+    return paths, np.array(students)
+
+
+if __name__ == '__main__':
+
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    paths, students = labelled_sheets(os.path.join('Dataset', 'Test_unknown'))
+    writers = np.array(teacher.writers())
+
+    for quantization in ['float16', 'int8']:
+        teacher.export_quantized(quantization)
+
+    # Decode once, so the timings only compare the inference backends
+    images = [np.stack(list(batch)) for batch in teacher.image_batches(paths, len(paths))][0]
+    float_predictions = None
+
+    print(f'{len(paths)} sheets, batch {len(paths)}, {repeats} repeats\n')
+    print(f'{"backend":<9} {"size (MB)":>10} {"load (s)":>9} {"ms/sheet":>9} {"accuracy":>9} {"agreement":>10}')
+    for backend in ['keras', 'float16', 'int8']:
+        path = model_registry.manifest()['path'] if backend == 'keras' else model_registry.tflite_path(backend)
+
+        # Fresh load of the artifact, bypassing the registry's cached copy
+        start = time.perf_counter()
+        if backend == 'keras':
+            model = model_registry.load_keras(path)['model']
+            predict = lambda: model.predict_on_batch(images)
+        else:
+            interpreter = model_registry.load_tflite(path)['interpreter']
+            input_index = interpreter.get_input_details()[0]['index']
+            interpreter.resize_tensor_input(input_index, images.shape)
+            interpreter.allocate_tensors()
+
+            def predict():
+                interpreter.set_tensor(input_index, images)
+                interpreter.invoke()
+                return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+        load_time = time.perf_counter() - start
+
+        predictions = np.argmax(predict(), axis=1)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            predict()
+        latency = (time.perf_counter() - start) / repeats / len(paths)
+
+        float_predictions = predictions if float_predictions is None else float_predictions
+        print(f'{backend:<9} {os.path.getsize(path) / 2 ** 20:>10.1f} {load_time:>9.2f} {latency * 1000:>9.2f} '
+              f'{np.mean(writers[predictions] == students):>9.1%} {np.mean(predictions == float_predictions):>10.1%}')
+
+    # The app path end to end (decode + batched inference) gives the same writers
+    for backend in ['float16', 'int8']:
+        agreement = np.mean(teacher.predict_writers(paths, backend=backend) == teacher.predict_writers(paths))
+        print(f'\npredict_writers(backend={backend!r}) agreement with keras: {agreement:.1%}', end='')
+    print()
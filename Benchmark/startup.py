@@ -0,0 +1,73 @@
+"""Cold start time and peak RSS per page, each measured in a fresh Python process, and a guard that
+the login pages start without TensorFlow, scikit-learn or OpenCV.
+
+Usage: python Benchmark/startup.py [runs]    (default: 3)
+
+Each page's main() is run in Streamlit bare mode right after 'import app', like the first script run
+of a new server worker. Exits with status 1 when a login page loads one of the heavy libraries.
+Run 'python app.py migrate' first so the database exists.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+heavy = ['tensorflow', 'sklearn', 'cv2']
+
+# page: (code run before 'import app', code run after it)
+pages = {
+    'admin login': ('', 'admin.main()'),
+    'teacher login': ('', 'teacher.main()'),
+    'student login': ('', 'student.main()'),
+    'supersub login': ('', 'supersub.main()'),
+    'assistant login': ('', 'assistant.main()'),
+    'teacher training pipeline': ('', "teacher.preprocess_image(os.path.join('Dataset', 'images', os.listdir(os.path.join('Dataset', 'images'))[0], "
+                                      "os.listdir(os.path.join('Dataset', 'images', os.listdir(os.path.join('Dataset', 'images'))[0]))[0])); "
+                                      "teacher.batches(np.zeros((1, 128, 128), np.uint8), np.zeros(1, np.int64), np.arange(1), 1); "
+                                      "from sklearn.model_selection import train_test_split"),
+    'eager imports (before)': ('import cv2, tensorflow.keras, tensorflow.keras.models, sklearn.model_selection', 'student.main()'),
+}
+
+probe = '''
+import os, sys, time, json, resource
+start = time.perf_counter()
+{before}
+import numpy as np
+from app import admin, teacher, student, supersub, assistant
+{after}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                   'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                   'loaded': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+
+def measure(before, after):
+
+    result = subprocess.run([sys.executable, '-c', probe.format(before=before, after=after, heavy=heavy)],
+                            cwd=root, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    failed = False
+
+    print(f'{"page":<28} {"start (s)":>10} {"peak RSS (MB)":>14}  heavy libraries loaded')
+    for page, (before, after) in pages.items():
+        results = [measure(before, after) for _ in range(runs)]
+        seconds = min(r['seconds'] for r in results)
+        rss = min(r['rss'] for r in results)
+        loaded = results[0]['loaded']
+
+        print(f'{page:<28} {seconds:>10.2f} {rss:>14.0f}  {", ".join(loaded) or "-"}')
+
+        if page.endswith('login') and loaded:
+            failed = True
+
+    if failed:
+        print('\nA login page imported TensorFlow, scikit-learn or OpenCV at startup')
+        sys.exit(1)
@@ -0,0 +1,117 @@
+"""Peak memory of the training data preparation: the previous in-memory float64 arrays vs the
+uint8 memory map with float32 batches (teacher.build_dataset + teacher.batches).
+
+Usage: python Benchmark/training_memory.py [images per writer] [writers]    (default: 400 6)
+
+Synthetic 128x128 samples are written to a temporary dataset folder. Every variant runs in a fresh
+process that prepares the data and reads one training epoch, and reports its peak resident set size
+(getrusage ru_maxrss): Python and NumPy arrays, TensorFlow's native buffers and the mapped pages of
+the dataset file all count. The increase is the peak minus the peak after the imports. Linux and macOS only.
+"""
+
+import os
+import sys
+import cv2
+import json
+import resource
+import subprocess
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import teacher
+from sklearn.model_selection import train_test_split
+
+
+def synthetic_dataset(data_path, images_per_writer, writers):
+
+    rng = np.random.default_rng(42)
+    for writer in range(writers):
+        os.makedirs(os.path.join(data_path, f'student{writer + 1}'))
+        for i in range(images_per_writer):
+            cv2.imwrite(os.path.join(data_path, f'student{writer + 1}', f'{i}.png'),
+                        rng.integers(0, 256, (128, 128), dtype=np.uint8))
+
+
+def in_memory(data_path, batch_size=32):
+
+    # The previous preparation in teacher.model_training
+    images, labels = [], []
+    for writer_id, writer in enumerate(os.listdir(data_path)):
+        writer_images = teacher.load_images(os.path.join(data_path, writer))
+        images.extend(writer_images)
+        labels.extend([writer_id] * len(writer_images))
+
+    images = np.array(images) / 255.0
+    labels = np.array(labels)
+    X_train, X_test, y_train, y_test = train_test_split(images, labels, test_size=0.2, random_state=42)
+
+    for start in range(0, len(X_train), batch_size):
+        X_train[start:start + batch_size].sum()
+
+
+def memory_mapped(data_path, batch_size):
+
+    writers, images, labels = teacher.build_dataset(data_path)
+    train_indices, test_indices = train_test_split(np.arange(len(labels)), test_size=0.2, random_state=42)
+
+    for batch, _ in teacher.batches(images, labels, train_indices, batch_size, shuffle=True).as_numpy_iterator():
+        batch.sum()
+
+
+def max_rss():
+
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def measure(variant, temp_dir, batch_size):
+
+    # Child process: both variants import TensorFlow before the baseline, the memory map needs it for the batches
+    import tensorflow
+
+    teacher.sample_cache = os.path.join(temp_dir, 'samples')
+    teacher.training_images = os.path.join(temp_dir, 'training_images')
+
+    baseline = max_rss()
+    {'in_memory': in_memory, 'memory_mapped': memory_mapped}[variant](os.path.join(temp_dir, 'images'), batch_size)
+    peak = max_rss()
+    print(json.dumps({'peak': peak, 'increase': peak - baseline}))
+
+
+def peak(variant, temp_dir, batch_size):
+
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', variant, temp_dir, str(batch_size)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ['--measure']:
+
+    measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+
+
+elif __name__ == '__main__':
+
+    images_per_writer = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = os.path.join(temp_dir, 'images')
+        synthetic_dataset(data_path, images_per_writer, writers)
+
+        # Fill the sample cache so both variants read the same cached samples
+        teacher.sample_cache = os.path.join(temp_dir, 'samples')
+        for writer in os.listdir(data_path):
+            teacher.load_images(os.path.join(data_path, writer))
+
+        total = images_per_writer * writers
+        print(f'{total} images, uint8 dataset {total * 128 * 128 / 2 ** 20:.1f} MiB\n')
+        print(f'{"preparation":<28} {"peak RSS (MiB)":>14} {"increase (MiB)":>15}')
+        for label, variant, batch_size in [('in-memory float64', 'in_memory', 32),
+                                           ('memory map, batch 32', 'memory_mapped', 32),
+                                           ('memory map, batch 128', 'memory_mapped', 128)]:
+            result = peak(variant, temp_dir, batch_size)
+            print(f'{label:<28} {result["peak"]:>14.1f} {result["increase"]:>15.1f}')
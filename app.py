@@ -1,23 +1,36 @@
+import io
 import os
-import cv2
+import json
+import sys
 import time
+import hashlib
+import secrets
+import shutil
+import subprocess
+import tempfile
+import threading
 import numpy as np
 import pandas as pd
 import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
 import bcrypt
+import openpyxl
 import streamlit as st
 from streamlit_option_menu import option_menu
 from streamlit_extras.add_vertical_space import add_vertical_space
 from dotenv import load_dotenv
 from PIL import Image
-from sklearn.model_selection import train_test_split
-from tensorflow.keras import layers, models
-from tensorflow.keras.models import load_model
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import warnings
 
 warnings.filterwarnings('ignore')
 load_dotenv()
 
+# TensorFlow, scikit-learn and OpenCV are imported inside the model training and handwriting verification
+# functions that use them, so the login pages and every other tab start without loading them
+
 
 def streamlit_config():
     # page configuration
@@ -43,68 +56,303 @@ def streamlit_config():
 
 
 
-class sql:
+class pooled_connection(psycopg2.extensions.connection):
+
+    # Remembers the statements prepared in its server session, a replaced connection starts empty
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+
+class connection_pool:
+
+    # Thread-safe PostgreSQL pool shared by every session of the Streamlit server process.
+    # Checkouts block up to 'timeout' seconds when all connections are busy instead of failing immediately.
+
+    def __init__(self, minconn, maxconn, timeout, health_check_interval):
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn,
+                                                          host=os.getenv('HOST'),
+                                                          user=os.getenv('USER'),
+                                                          password=os.getenv('PASSWORD'),
+                                                          database=os.getenv('DATABASE'),
+                                                          connection_factory=pooled_connection)
+
+        # One slot per connection, so getconn never hits the PoolError of an exhausted psycopg2 pool
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.counters = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'reconnects': 0}
+
+        # Open connections by state, updated under _lock together with the calls into the psycopg2 pool
+        self.idle = minconn
+        self.in_use = 0
+
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
 
-    def create_database():
+
+    def _healthy(self, connection):
+
+        if connection.closed:
+            return False
+
+        # Recently used connections are trusted without an extra round-trip
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DEFAULT_DATABASE'))
+            with connection.cursor() as cursor:
+                cursor.execute('select 1;')
+            connection.rollback()
+            return True
 
-            connection.autocommit = True
-            cursor = connection.cursor()
+        except psycopg2.Error:
+            return False
 
-            # create a new database
-            cursor.execute(f"create database {os.getenv('DATABASE')};")
 
-        # If database already exist means skip the process
-        except psycopg2.errors.DuplicateDatabase:
-            pass
+    def getconn(self):
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+        # Wait for a free slot when every connection is checked out
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise psycopg2.pool.PoolError(f'No database connection available within {self.timeout} seconds')
+
+        try:
+            # Broken idle connections (server restart, idle timeout) are closed until one answers, after a restart
+            # that can be all of them. Once the idle ones are used up the psycopg2 pool opens a new connection.
+            while True:
+                with self._lock:
+                    connection = self._pool.getconn()
+                    was_idle = self.idle > 0
+                    self.idle -= was_idle
+                    self.in_use += 1
+
+                if not was_idle or self._healthy(connection):
+                    break
 
+                self._last_used.pop(id(connection), None)
+                with self._lock:
+                    self._pool.putconn(connection, close=True)
+                    self.in_use -= 1
+                    self.counters['reconnects'] += 1
 
-    def create_login_credentials_table():
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._count('checkouts')
+        return connection
+
+
+    def putconn(self, connection):
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
+            close = connection.closed != 0
+
+            # Never hand out a connection with an open or aborted transaction
+            if not close and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    close = True
+
+            with self._lock:
+                # Like the psycopg2 pool, up to minconn connections are kept idle and the others are closed
+                close = close or self.idle >= self.minconn
+                self._pool.putconn(connection, close=close)
+                self.idle += not close
+                self.in_use -= 1
+
+            if close:
+                self._last_used.pop(id(connection), None)
+            else:
+                self._last_used[id(connection)] = time.monotonic()
 
-            cursor = connection.cursor()
+        finally:
+            self._slots.release()
 
-            cursor.execute(f'''create table if not exists login_credentials(
-                                    user_id         varchar(255) not null,
-                                    password        varchar(255) not null,
-                                    role		    varchar(255) not null,
-                                    primary key (user_id, role));''')
 
-            connection.commit()
+    def stats(self):
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_use'] = self.in_use
+            stats['idle'] = self.idle
+
+        stats['min_size'] = self.minconn
+        stats['max_size'] = self.maxconn
+        return stats
+
+
+
+class sql:
+
+    # Created once per Streamlit server process and shared across reruns and sessions
+    @st.cache_resource
+    def pool():
+        return connection_pool(minconn=int(os.getenv('POOL_MIN_SIZE', 1)),
+                               maxconn=int(os.getenv('POOL_MAX_SIZE', 20)),
+                               timeout=float(os.getenv('POOL_TIMEOUT', 10)),
+                               health_check_interval=float(os.getenv('POOL_HEALTH_CHECK_INTERVAL', 30)))
+
+
+    def get_connection():
+        return sql.pool().getconn()
+
+
+    def release_connection(connection):
+        sql.pool().putconn(connection)
+
+
+    # Hot single-row lookups, prepared once per pooled connection and executed with bound parameters
+    statements = {'login_password': '''select password from login_credentials
+                                        where user_id=$1 and role like $2 || '%' ''',
+                  'user_role': '''select role from login_credentials
+                                   where user_id=$1''',
+                  'portal_status': '''select status from status
+                                       where identifier=$1''',
+                  'student_test_answers': '''select * from student_test
+                                              where student_id=$1 and test_id=$2''',
+                  'next_answer_sheets': '''select a.file_name, a.student_id, a.question_no, a.path
+                                            from answer_sheet a
+                                            where a.concept=$1 and not exists (
+                                                 select 1 from answer_sheet_evaluation e
+                                                 where e.evaluator_id=$2 and e.concept=a.concept and e.file_name=a.file_name)
+                                            order by a.question_no, a.file_name
+                                            limit $3''',
+                  'pending_answer_sheets': '''select (select count(*) from answer_sheet where concept=$1) -
+                                                     (select count(*) from answer_sheet_evaluation
+                                                      where evaluator_id=$2 and concept=$1)''',
+                  'cache_generations': '''select name, generation from cache_generation'''}
+
+
+    def execute_prepared(cursor, name, params=()):
+
+        connection = cursor.connection
+
+        # Parsed and planned by PostgreSQL once per connection, later calls only bind the parameters
+        if name not in connection.prepared:
+            cursor.execute(f'''prepare {name} as {sql.statements[name]};''')
+            connection.prepared.add(name)
+
+        placeholders = ', '.join(['%s'] * len(params))
+        cursor.execute(f'''execute {name}({placeholders});''' if params else f'''execute {name};''', params)
+
+
+    def read_upload(uploaded_file, chunksize=50000):
+
+        # Read an uploaded CSV/XLSX file as DataFrame chunks instead of one DataFrame of the whole file.
+        # Every cell is read as text and a blank cell is '', so 1234 is never read as 1234.0 or a blank as 'nan'
+        if uploaded_file.name.endswith('.csv'):
+            yield from pd.read_csv(uploaded_file, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+        elif uploaded_file.name.endswith('.xlsx'):
+            workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                columns = next(rows)
+                chunk = []
+
+                for row in rows:
+                    chunk.append(['' if value is None else str(value) for value in row])
+                    if len(chunk) == chunksize:
+                        yield pd.DataFrame(chunk, columns=columns)
+                        chunk = []
+
+                if chunk:
+                    yield pd.DataFrame(chunk, columns=columns)
+
+            finally:
+                workbook.close()
+
+
+    def bulk_load(cursor, table, columns, data, key=None, update=False, chunksize=50000):
+
+        # Stream a DataFrame (or an iterable of DataFrame chunks) with COPY FROM STDIN into a temporary
+        # staging table, then merge it into the target table with a single insert ... select.
+        # key=None keeps plain insert semantics (duplicates raise UniqueViolation), otherwise rows that
+        # conflict on the key columns are skipped, or overwritten when update=True.
+
+        staging = f'{table}_staging'
+        column_list = ', '.join(columns)
+
+        # load_order numbers the rows in the order COPY reads them
+        cursor.execute(f'''create temp table if not exists {staging}
+                           (like {table} including defaults, load_order bigserial) on commit drop;''')
+        cursor.execute(f'''truncate {staging};''')
+
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+
+        for chunk in chunks:
+            for start in range(0, len(chunk), chunksize):
+                buffer = io.StringIO()
+                chunk.iloc[start:start + chunksize].to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cursor.copy_expert(f'''copy {staging}({column_list}) from stdin with (format csv);''', buffer)
+
+        if key is None:
+            cursor.execute(f'''insert into {table}({column_list})
+                               select {column_list} from {staging};''')
+
+        elif update:
+            # distinct on: one row per key, otherwise on conflict do update fails on duplicates in the file.
+            # The last row of a repeated key wins, like a later upload overwrites an earlier one
+            key_list = ', '.join(key)
+            assignments = ', '.join(f'{i}=excluded.{i}' for i in columns if i not in key)
+            cursor.execute(f'''insert into {table}({column_list})
+                               select distinct on ({key_list}) {column_list} from {staging}
+                               order by {key_list}, load_order desc
+                               on conflict ({key_list}) do update set {assignments};''')
+
+        else:
+            cursor.execute(f'''insert into {table}({column_list})
+                               select {column_list} from {staging}
+                               on conflict ({', '.join(key)}) do nothing;''')
+
+        return cursor.rowcount
+
+
+    def create_database():
+
+        connection = psycopg2.connect(host=os.getenv('HOST'),
+                                      user=os.getenv('USER'),
+                                      password=os.getenv('PASSWORD'),
+                                      database=os.getenv('DEFAULT_DATABASE'))
+
+        connection.autocommit = True
+        cursor = connection.cursor()
+
+        try:
+            # create a new database
+            cursor.execute(f"create database {os.getenv('DATABASE')};")
+
+        # If database already exist means skip the process
+        except psycopg2.errors.DuplicateDatabase:
+            pass
 
         finally:
             # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            cursor.close()
+            connection.close()
 
 
-    def encode_password(password):
-        salt = bcrypt.gensalt()
+    def encode_password(password, rounds=12):
+        salt = bcrypt.gensalt(rounds=rounds)
         hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
         encode = hashed_password.decode('utf-8')
         return encode
@@ -112,13 +360,10 @@ class sql:
 
     def add_user_login_credentials_table(user_id, password, role):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             # Encode the password
             hashed_password = sql.encode_password(password)
 
@@ -144,45 +389,67 @@ class sql:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    # Worker threads for bulk password hashing, bcrypt releases the GIL while hashing
+    @st.cache_resource
+    def hash_executor():
+        return ThreadPoolExecutor(max_workers=int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 1)),
+                                  thread_name_prefix='bcrypt')
+
 
+    def encode_passwords(passwords, rounds):
+        return list(sql.hash_executor().map(partial(sql.encode_password, rounds=rounds), passwords))
 
-    def add_multiple_user_login_credentials_table(df):
+
+    def existing_users(keys):
+
+        # (user_id, role) pairs of an upload that already have an account
+        user_ids, roles = [list(i) for i in zip(*keys)] or [[], []]
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+            cursor.execute(f'''select user_id, role from login_credentials
+                               where (user_id, role) in (select * from unnest(%s::varchar[], %s::varchar[]));''',
+                           (user_ids, roles))
+            return set(cursor.fetchall())
 
-            cursor.executemany(f'''insert into login_credentials(user_id, password, role) 
-                               values(%s,%s,%s);''', df.values.tolist())
-            connection.commit()
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+
+    def add_multiple_user_login_credentials_table(chunks):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            # Every chunk is COPied into one staging table and merged with one insert, the whole file is added
+            # in one transaction or not at all. Users that already exist with the same role are skipped.
+            added = sql.bulk_load(cursor, 'login_credentials', ['user_id', 'password', 'role'], chunks,
+                                  key=['user_id', 'role'])
+            connection.commit()
+            return added
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def update_user_login_credentials_table(user_id, password, role):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             # Encode the password
             hashed_password = sql.encode_password(password)
 
@@ -192,6 +459,9 @@ class sql:
                                where user_id='{user_id}';''')
             connection.commit()
 
+            # Existing logins of this user must authenticate again
+            session.revoke_user(user_id)
+
             st.markdown(f'<h5 style="color: green;">User Details Updated Successfully</h5>', unsafe_allow_html=True)
             # Trigger a rerun to Refresh the Page
             st.experimental_rerun()
@@ -201,25 +471,24 @@ class sql:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def delete_user_login_credentials_table(user_id, role):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''delete from login_credentials
                                where user_id='{user_id}' and role='{role}';''')
             connection.commit()
 
+            # Existing logins of this user must authenticate again
+            session.revoke_user(user_id)
+
             st.markdown(f'<h5 style="color: green;">User Details Deleted Successfully</h5>', unsafe_allow_html=True)
             # Trigger a rerun to Refresh the Page
             st.experimental_rerun()
@@ -229,23 +498,18 @@ class sql:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def login_credentials_verification(user_id, password, role):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
-            cursor.execute(f'''select password from login_credentials
-                            where user_id='{user_id}' and role like '{role}%';''')
+        try:
+            sql.execute_prepared(cursor, 'login_password', (user_id, role))
             result = cursor.fetchall()
 
             # Encoded Password retrieved from SQL Table
@@ -253,9 +517,7 @@ class sql:
 
             # Verify the User Input Password is Matched with Encoded Hashed Password
             if bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8')):
-                with st.spinner('Logging in...'):
-                    time.sleep(2)
-                    st.markdown(f'<h5 style="color: green;">LogIn Successfully</h5>', unsafe_allow_html=True)
+                st.markdown(f'<h5 style="color: green;">LogIn Successfully</h5>', unsafe_allow_html=True)
                 return 'LogIn Successfully'
 
             else:
@@ -271,59 +533,21 @@ class sql:
             return e
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
-
-    def create_test_qa_table():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-
-            cursor = connection.cursor()
-
-            cursor.execute(f'''create table if not exists test_qa(
-                                    test_id         varchar(255) not null,
-                                    concept         varchar(255) not null,
-                                    question_no     varchar(255) not null,
-                                    question        varchar(255) not null,
-                                    option_a        varchar(255) not null,
-                                    option_b        varchar(255) not null,
-                                    option_c        varchar(255) not null,
-                                    option_d        varchar(255) not null,
-                                    answer          varchar(255) not null,
-                                    primary key(test_id, question_no));''')
-
-            connection.commit()
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def migrate_test_qa_table(df):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
-            cursor.executemany(f'''insert into test_qa(test_id, concept, question_no, question, 
-                                                       option_a, option_b, option_c, option_d, answer) 
-                                   values(%s,%s,%s,%s,%s,%s,%s,%s,%s);''', df.values.tolist())
+        try:
+            # df can also be an iterable of chunks from sql.read_upload, a repeated question keeps its last row
+            sql.bulk_load(cursor, 'test_qa', ['test_id', 'concept', 'question_no', 'question',
+                                              'option_a', 'option_b', 'option_c', 'option_d', 'answer'], df,
+                          key=['test_id', 'question_no'], update=True)
             connection.commit()
 
             add_vertical_space(2)
@@ -334,57 +558,26 @@ class sql:
             st.markdown(f'<h5 style="color: orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            if connection:
-                cursor.close()
-                connection.close()
-
-
-    def create_student_test_table():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-
-            cursor = connection.cursor()
-
-            cursor.execute(f'''create table if not exists student_test(
-                                    student_id      varchar(255) not null,
-                                    test_id         varchar(255) not null,
-                                    concept         varchar(255) not null,
-                                    question_no     int,
-                                    question	    text not null,
-                                    answer          text not null,
-                                    mark            int,
-                                    primary key (student_id, test_id, concept, question_no));''')
-
-            connection.commit()
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def migrate_student_test_table(df):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
-            cursor.executemany(f'''insert into student_test(student_id, test_id, concept, question_no, question, answer, mark) 
-                                   values(%s,%s,%s,%s,%s,%s,%s);''', df.values.tolist())
+        try:
+            # A test that was already submitted is not overwritten
+            sql.bulk_load(cursor, 'student_test', ['student_id', 'test_id', 'concept', 'question_no',
+                                                   'question', 'answer', 'mark'], df,
+                          key=['student_id', 'test_id', 'concept', 'question_no'])
             connection.commit()
 
+            # Cached test ID and student ID lists are stale from now on
+            cache.invalidate('student_test')
+
             # Finally clear the data from session state
             st.session_state.test_data = {'student_id': [], 'test_id': [], 'question_no': [],
                                           'concept': [], 'question': [], 'answer': [], 'mark': []}
@@ -399,98 +592,38 @@ class sql:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
-
-    def create_student_exam_table():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-
-            cursor = connection.cursor()
-
-            cursor.execute(f'''create table if not exists student_exam(
-                                    student_id      varchar(255) not null,
-                                    exam_id         varchar(255) not null,
-                                    concept         varchar(255) not null,
-                                    question_no     int not null,
-                                    mark            int not null,
-                                    evaluator_id    varchar(255) not null,
-                                    primary key (student_id, exam_id, concept, question_no, evaluator_id));''')
-
-            connection.commit()
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def user_id():
 
-        connection = psycopg2.connect(host=os.getenv('HOST'),
-                                      user=os.getenv('USER'),
-                                      password=os.getenv('PASSWORD'),
-                                      database=os.getenv('DATABASE'))
+        connection = sql.get_connection()
         cursor = connection.cursor()
 
-        cursor.execute(f'''select distinct user_id from login_credentials
-                           order by user_id;''')
-
-        result = cursor.fetchall()
-
-        user_id = [i[0] for i in result]
-
-        return user_id
-
-
-    def create_status_table():
-
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
+            cursor.execute(f'''select distinct user_id from login_credentials
+                               order by user_id;''')
 
-            cursor = connection.cursor()
-
-            cursor.execute(f'''create table if not exists status(
-                                    identifier      varchar(255) primary key,
-                                    status          varchar(255));''')
+            result = cursor.fetchall()
 
-            connection.commit()
+            user_id = [i[0] for i in result]
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+            return user_id
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def delete_exam_marks_status_table(identifier, status):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''delete from status
                                where identifier='{identifier}';''')
             connection.commit()
@@ -507,21 +640,17 @@ class sql:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def migrate_status_table(identifier, status):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''insert into status(identifier, status) 
                                values('{identifier}', '{status}');''')
             connection.commit()
@@ -538,115 +667,1484 @@ class sql:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
-    def create_student_marks_table():
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
+    # Database & table setup runs once per server process, later reruns only read the cached result
+    @st.cache_resource(show_spinner='Setting up the database...')
+    def main():
+        return migration.run()
+
+
+
+class migration:
+
+    # Ordered schema steps, each one is applied once and recorded in the schema_version table.
+    # Add new steps at the end of 'steps' with the next version number, never edit an applied step.
+    # Steps only change the schema: the transaction cannot undo file work, and data of the Result folders
+    # is imported after the commit by catalog.import_folders, with whatever that code does at the time.
+
+    def create_tables(cursor):
+
+        cursor.execute(f'''create table if not exists login_credentials(
+                                user_id         varchar(255) not null,
+                                password        varchar(255) not null,
+                                role		    varchar(255) not null,
+                                primary key (user_id, role));''')
+
+        cursor.execute(f'''create table if not exists student_test(
+                                student_id      varchar(255) not null,
+                                test_id         varchar(255) not null,
+                                concept         varchar(255) not null,
+                                question_no     int,
+                                question	    text not null,
+                                answer          text not null,
+                                mark            int,
+                                primary key (student_id, test_id, concept, question_no));''')
+
+        cursor.execute(f'''create table if not exists student_exam(
+                                student_id      varchar(255) not null,
+                                exam_id         varchar(255) not null,
+                                concept         varchar(255) not null,
+                                question_no     int not null,
+                                mark            int not null,
+                                evaluator_id    varchar(255) not null,
+                                primary key (student_id, exam_id, concept, question_no, evaluator_id));''')
+
+        cursor.execute(f'''create table if not exists test_qa(
+                                test_id         varchar(255) not null,
+                                concept         varchar(255) not null,
+                                question_no     varchar(255) not null,
+                                question        varchar(255) not null,
+                                option_a        varchar(255) not null,
+                                option_b        varchar(255) not null,
+                                option_c        varchar(255) not null,
+                                option_d        varchar(255) not null,
+                                answer          varchar(255) not null,
+                                primary key(test_id, question_no));''')
+
+        cursor.execute(f'''create table if not exists status(
+                                identifier      varchar(255) primary key,
+                                status          varchar(255));''')
+
+        cursor.execute(f'''create table if not exists student_marks(
+                                student_id      varchar(255) not null,
+                                exam_id         varchar(255) not null,
+                                concept         varchar(255) not null,
+                                question_no     int   not null,
+                                mark            float not null,
+                                primary key (student_id, exam_id, concept, question_no));''')
 
-            cursor = connection.cursor()
 
-            cursor.execute(f'''create table if not exists student_marks(
-                                    student_id      varchar(255) not null,
-                                    exam_id         varchar(255) not null,
-                                    concept         varchar(255) not null,
-                                    question_no     int   not null,
-                                    mark            float not null,
-                                    primary key (student_id, exam_id, concept, question_no));''')
+    def add_default_records(cursor):
 
-            connection.commit()
+        # Default admin account and closed answer sheet upload portal
+        cursor.execute(f'''insert into login_credentials(user_id, password, role)
+                           values('admin', %s, 'admin')
+                           on conflict do nothing;''', (sql.encode_password('admin'),))
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+        cursor.execute(f'''insert into status(identifier, status)
+                           values('upload_portal', 'close')
+                           on conflict do nothing;''')
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
 
+    def create_indexes(cursor):
 
-    def main():
+        # The primary keys lead with student_id and already serve the per-student lookups,
+        # these cover the filters and dropdowns that start from test_id / exam_id.
 
-        sql.create_database()
-        sql.create_login_credentials_table()
-        sql.create_student_test_table()
-        sql.create_student_exam_table()
-        sql.create_test_qa_table()
-        sql.create_status_table()
-        sql.create_student_marks_table()
-        sql.add_user_login_credentials_table(user_id='admin', password='admin', role='admin')
-        sql.migrate_status_table(identifier='upload_portal', status='close')
+        # teacher.student_test_status by test_id
+        cursor.execute(f'''create index if not exists student_test_test_id_idx
+                           on student_test(test_id, student_id);''')
 
+        # teacher.query_student_exam_analytics and the marks finalization by exam_id
+        cursor.execute(f'''create index if not exists student_exam_exam_id_idx
+                           on student_exam(exam_id, student_id);''')
 
+        # teacher.mark_delete_student_marks_table by exam_id
+        cursor.execute(f'''create index if not exists student_marks_exam_id_idx
+                           on student_marks(exam_id);''')
 
-class admin:
 
-    def account_login(role):
+    def create_answer_sheet_catalog(cursor):
 
-        col1, col2, col3, col4 = st.columns([0.1, 0.4, 0.4, 0.1], gap='medium')
+        # Answer sheets that passed handwriting verification, with the fields of their file name
+        cursor.execute(f'''create table if not exists answer_sheet(
+                                concept         varchar(255) not null,
+                                file_name       varchar(255) not null,
+                                student_id      varchar(255) not null,
+                                question_no     int not null,
+                                path            text not null,
+                                added_at        timestamp not null default now(),
+                                primary key (concept, file_name));''')
+
+        # Sheets each evaluator has finished
+        cursor.execute(f'''create table if not exists answer_sheet_evaluation(
+                                evaluator_id    varchar(255) not null,
+                                concept         varchar(255) not null,
+                                file_name       varchar(255) not null,
+                                evaluated_at    timestamp not null default now(),
+                                primary key (evaluator_id, concept, file_name),
+                                foreign key (concept, file_name) references answer_sheet on delete cascade);''')
+
+        # supersub.evaluation: next sheet of a concept in question order
+        cursor.execute(f'''create index if not exists answer_sheet_next_idx
+                           on answer_sheet(concept, question_no, file_name);''')
+
+
+    def create_answer_sheet_store(cursor):
+
+        # Answer sheet names of each area and the blob with their bytes (storage)
+        cursor.execute(f'''create table if not exists answer_sheet_file(
+                                area            varchar(255) not null,
+                                file_name       varchar(255) not null,
+                                student_id      varchar(255) not null,
+                                concept         varchar(255) not null,
+                                question_no     int not null,
+                                blob            char(64) not null,
+                                size            bigint not null,
+                                stored_at       timestamp not null default now(),
+                                primary key (area, file_name));''')
 
-        with col2:
-            user_id = st.text_input(label='User ID')
+        # Sheets of a student by concept and question
+        cursor.execute(f'''create index if not exists answer_sheet_file_student_idx
+                           on answer_sheet_file(student_id, concept, question_no);''')
 
-        with col3:
-            password = st.text_input(label='Password', type='password')
 
-        if user_id == '' and password == '':
+    def create_cache_generation(cursor):
 
-            add_vertical_space(1)
-            col1, col2, col3, col4 = st.columns([0.1, 0.4, 0.4, 0.1], gap='medium')
+        # Cache generations bumped by writers in other processes (cache.publish)
+        cursor.execute(f'''create table if not exists cache_generation(
+                                name            varchar(255) primary key,
+                                generation      bigint not null default 0);''')
 
-            with col2:
-                st.markdown(f'<h5 style="color: orange;">Please Enter User ID and Password</h5>',
-                            unsafe_allow_html=True)
 
+    steps = [(1, 'create tables', create_tables),
+             (2, 'add default admin and upload portal status', add_default_records),
+             (3, 'add exam_id and test_id indexes', create_indexes),
+             (4, 'create the answer sheet catalog from the Result folders', create_answer_sheet_catalog),
+             (5, 'create the content-addressed answer sheet store', create_answer_sheet_store),
+             (6, 'add the shared cache generation table', create_cache_generation)]
 
-        elif user_id != '' and password != '':
 
-            add_vertical_space(1)
-            col1, col2, col3, col4 = st.columns([0.1, 0.4, 0.4, 0.1], gap='medium')
+    def latest():
+        return migration.steps[-1][0]
 
-            with col2:
-                status = sql.login_credentials_verification(user_id, password, role)
 
-            return user_id, status
+    def run():
 
+        sql.create_database()
 
-    def view_user():
-        connection = psycopg2.connect(host=os.getenv('HOST'),
-                                      user=os.getenv('USER'),
-                                      password=os.getenv('PASSWORD'),
-                                      database=os.getenv('DATABASE'))
+        connection = sql.get_connection()
         cursor = connection.cursor()
 
-        cursor.execute(f'''select user_id, role from login_credentials
-                           order by user_id;''')
-        result = cursor.fetchall()
+        try:
+            # Serialize concurrent runners (several server processes starting together)
+            cursor.execute(f'''select pg_advisory_xact_lock(hashtext('schema_version'));''')
+
+            cursor.execute(f'''create table if not exists schema_version(
+                                    version         int primary key,
+                                    description     varchar(255) not null,
+                                    applied_at      timestamp not null default now());''')
+
+            cursor.execute(f'''select coalesce(max(version), 0) from schema_version;''')
+            current_version = cursor.fetchone()[0]
+
+            applied = []
+            for version, description, step in migration.steps:
+                if version > current_version:
+                    step(cursor)
+                    cursor.execute(f'''insert into schema_version(version, description)
+                                       values(%s, %s);''', (version, description))
+                    applied.append((version, description))
+
+            # All pending steps are committed together or not at all
+            connection.commit()
 
-        index = [i for i in range(1, len(result) + 1)]
-        columns = [i[0] for i in cursor.description]
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
-        df = pd.DataFrame(result, columns=columns, index=index)
-        df = df.rename_axis('s.no')
-        df = pd.DataFrame(df)
-        st.dataframe(df)
+        # Answer sheets and evaluations of the Result folders (idempotent, a failed import is retried on the next run)
+        catalog.import_folders()
 
+        return applied
 
-    def add_user():
-        
-        add_vertical_space(1)
-        try:
-            with st.form('Add User'):
+
+
+class session:
+
+    # Server-side login sessions: credentials are verified once per login, later reruns resolve the user
+    # from the token kept in st.session_state. Tokens are bound to the page role and expire after SESSION_TTL seconds.
+
+    @st.cache_resource
+    def store():
+        return {'tokens': {}, 'lock': threading.Lock()}
+
+
+    def create(user_id, role):
+
+        store = session.store()
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+
+        with store['lock']:
+            # Drop expired tokens of other sessions
+            for expired in [t for t, record in store['tokens'].items() if record['expires'] <= now]:
+                del store['tokens'][expired]
+
+            store['tokens'][token] = {'user_id': user_id, 'role': role,
+                                      'expires': now + float(os.getenv('SESSION_TTL', 3600))}
+
+        st.session_state.auth_token = token
+
+
+    def current(role):
+
+        token = st.session_state.get('auth_token')
+        record = session.store()['tokens'].get(token)
+
+        # Missing, expired or revoked token, or a token issued for another page role
+        if record is None or record['role'] != role:
+            return None
+
+        if record['expires'] <= time.time():
+            session.end()
+            return None
+
+        return record
+
+
+    def end():
+
+        store = session.store()
+        token = st.session_state.pop('auth_token', None)
+
+        with store['lock']:
+            store['tokens'].pop(token, None)
+
+
+    def revoke_user(user_id):
+
+        # Force a new login after the user's password or role has changed
+        store = session.store()
+
+        with store['lock']:
+            for token in [t for t, record in store['tokens'].items() if record['user_id'] == user_id]:
+                del store['tokens'][token]
+
+
+
+class cache:
+
+    # Process-wide read cache for query results. Entries are tagged with the generation of their table,
+    # write paths call cache.invalidate(table) so every result read before the write is refetched.
+    # Writers that may run in another process (python app.py import-evaluations) also call cache.publish
+    # in their transaction, the shared generation in the cache_generation table is checked every few seconds.
+
+    @st.cache_resource
+    def store():
+        return {'generation': {}, 'shared': {}, 'synced': 0.0, 'entries': {},
+                'lock': threading.Lock(), 'sync_lock': threading.Lock()}
+
+
+    def shared_generation(table):
+
+        store = cache.store()
+        interval = float(os.getenv('CACHE_SYNC_INTERVAL', 5))
+
+        # One session syncs at a time, never under the cache lock. The others keep the last generations read meanwhile.
+        if time.time() - store['synced'] > interval and store['sync_lock'].acquire(blocking=False):
+            try:
+                connection = sql.get_connection()
+                cursor = connection.cursor()
+
+                try:
+                    sql.execute_prepared(cursor, 'cache_generations')
+                    store['shared'] = dict(cursor.fetchall())
+                    store['synced'] = time.time()
+
+                finally:
+                    # return the connection to the pool
+                    cursor.close()
+                    sql.release_connection(connection)
+
+            finally:
+                store['sync_lock'].release()
+
+        return store['shared'].get(table, 0)
+
+
+    def generation(table):
+        return cache.store()['generation'].get(table, 0), cache.shared_generation(table)
+
+
+    def publish(cursor, table):
+
+        # Committed with the writer's transaction, other processes refetch within CACHE_SYNC_INTERVAL seconds
+        cursor.execute(f'''insert into cache_generation(name, generation)
+                           values(%s, 1)
+                           on conflict (name) do update set generation = cache_generation.generation + 1;''', (table,))
+
+
+    def invalidate(table):
+
+        store = cache.store()
+
+        with store['lock']:
+            store['generation'][table] = store['generation'].get(table, 0) + 1
+
+            for key in [k for k in store['entries'] if k[0] == table]:
+                del store['entries'][key]
+
+
+    def get(table, key, loader):
+
+        store = cache.store()
+        generation = cache.generation(table)
+
+        entry = store['entries'].get((table, key))
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+
+        value = loader()
+
+        # The shared generation before taking the lock, its sync may wait for the database
+        shared = cache.shared_generation(table)
+
+        with store['lock']:
+            # Skip caching when a write happened while the query was running
+            if (store['generation'].get(table, 0), shared) == generation:
+                store['entries'][(table, key)] = (generation, value)
+
+                # Evict the oldest entries beyond the size limit
+                while len(store['entries']) > int(os.getenv('CACHE_MAX_ENTRIES', 256)):
+                    del store['entries'][next(iter(store['entries']))]
+
+        return value
+
+
+
+class pagination:
+
+    # Keyset pagination for the status tables. A page is the next `limit` rows after the sort key of the
+    # last row on the previous page, so every page is one bounded range scan however far the user pages,
+    # and only one page of rows is ever held in memory. Sort keys must end in a unique column set.
+
+    page_sizes = [25, 50, 100, 500]
+
+
+    def order_by(keys, descending):
+        return ', '.join(f"{key} {'desc' if descending else 'asc'}" for key in keys)
+
+
+    def after(keys, last_key, descending):
+
+        # Row comparison (k1, k2, ...) > (v1, v2, ...) continues in sort order after the previous page
+        if last_key is None:
+            return 'true', []
+
+        placeholders = ', '.join(['%s'] * len(keys))
+        return f"({', '.join(keys)}) {'<' if descending else '>'} ({placeholders})", list(last_key)
+
+
+    def fetch(query, params, keys, last_key, descending, limit):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            condition, values = pagination.after(keys, last_key, descending)
+
+            # One extra row tells whether a next page exists
+            cursor.execute(f'''select * from ({query}) as page
+                               where {condition}
+                               order by {pagination.order_by(keys, descending)}
+                               limit %s;''', list(params) + values + [limit + 1])
+            result = cursor.fetchall()
+
+            columns = [i[0] for i in cursor.description]
+            rows = result[:limit]
+
+            df = pd.DataFrame(rows, columns=columns)
+            bounds = None
+            if rows:
+                position = [columns.index(key) for key in keys]
+                bounds = tuple([row[i] for i in position] for row in (rows[0], rows[-1]))
+
+            return df, bounds, len(result) > limit
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def controls(name, sort_options, filters=()):
+
+        col1, col2, col3 = st.columns([0.4, 0.3, 0.3], gap='medium')
+        with col1:
+            sort = st.selectbox(label='Sort By', options=list(sort_options), key=f'{name}_sort')
+        with col2:
+            order = st.selectbox(label='Order', options=['Ascending', 'Descending'], key=f'{name}_order')
+        with col3:
+            limit = st.selectbox(label='Rows per Page', options=pagination.page_sizes, index=1, key=f'{name}_limit')
+
+        keys, descending = sort_options[sort], order == 'Descending'
+
+        # The stack holds the last key of every previous page, a new sort or filter starts from page 1
+        signature = (sort, order, limit, tuple(filters))
+        state = st.session_state.get(f'{name}_page')
+        if state is None or state['signature'] != signature:
+            state = {'signature': signature, 'cursors': [None]}
+            st.session_state[f'{name}_page'] = state
+
+        return keys, descending, limit, state
+
+
+    def navigation(name, state, bounds, has_next):
+
+        page = len(state['cursors'])
+
+        col1, col2, col3 = st.columns([0.2, 0.6, 0.2], gap='medium')
+        with col1:
+            previous = st.button(label='Previous', key=f'{name}_previous', disabled=page == 1)
+        with col2:
+            st.markdown(f'<p style="text-align:center;">Page {page}</p>', unsafe_allow_html=True)
+        with col3:
+            next = st.button(label='Next', key=f'{name}_next', disabled=not has_next)
+
+        if previous:
+            state['cursors'].pop()
+            st.experimental_rerun()
+
+        if next and bounds is not None:
+            state['cursors'].append(bounds[1])
+            st.experimental_rerun()
+
+
+    def view(name, query, params, sort_options, filters=()):
+
+        keys, descending, limit, state = pagination.controls(name, sort_options, filters)
+        df, bounds, has_next = pagination.fetch(query, params, keys, state['cursors'][-1], descending, limit)
+
+        if df.empty:
+            add_vertical_space(1)
+            st.markdown(f'<h5 style="color:orange;">No Records Found</h5>', unsafe_allow_html=True)
+            return df
+
+        start = (len(state['cursors']) - 1) * limit + 1
+        df.index = range(start, start + len(df))
+        df = df.rename_axis('s.no')
+        st.dataframe(df)
+
+        pagination.navigation(name, state, bounds, has_next)
+        return df
+
+
+
+class storage:
+
+    # Answer sheet files are stored with the bytes that were uploaded, never decoded and encoded again.
+    # Every distinct content is one blob in Result/blobs named by its SHA-256, two levels of fan-out folders
+    # keep each folder to a few hundred entries. The answer_sheet_file table maps the sheet names of each area
+    # (matched, mismatched, teacher) to their student, concept, question and blob, so a byte-identical upload
+    # only adds an index row. Blobs are never overwritten, a changed sheet uploaded again gets a new blob.
+
+    root = os.path.join('Result','blobs')
+
+    # Folders of the layout before the blob store, moved into it by catalog.import_folders
+    legacy_roots = {'mismatched': os.path.join('Result','handwriting','mismatched'),
+                    'teacher': os.path.join('Result','teacher')}
+
+    columns = ['area', 'file_name', 'student_id', 'concept', 'question_no', 'blob', 'size']
+
+    def write(path, data):
+
+        # Written under a temporary name and renamed, a reader never sees a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+
+    def link(source, target):
+
+        # Second name for the same file: a hard link, or a copy where the file system has none
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f'{target}.{threading.get_ident()}.tmp'
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+
+
+    def blob_path(digest):
+
+        # Ex: Result/blobs/9f/86/9f86d081884c7d65...
+        return os.path.join(storage.root, digest[:2], digest[2:4], digest)
+
+
+    def put(data):
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = storage.blob_path(digest)
+
+        # The same bytes have the same name, a re-upload finds its blob and writes nothing
+        if not os.path.exists(path):
+            storage.write(path, data)
+
+        return digest
+
+
+    def put_file(path, chunk_size=1 << 20):
+
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(partial(file.read, chunk_size), b''):
+                sha256.update(chunk)
+
+        digest = sha256.hexdigest()
+
+        # Files of the old layout are linked into the store, not copied
+        if not os.path.exists(storage.blob_path(digest)):
+            storage.link(path, storage.blob_path(digest))
+
+        return digest
+
+
+    def rows(area, blobs):
+
+        # (file name, blob, size) to index rows, files that are not named like an answer sheet are skipped
+        rows = []
+        for file_name, digest, size in blobs:
+            try:
+                student_id, concept, question_no = catalog.parse(file_name)
+            except (IndexError, ValueError):
+                continue
+
+            rows.append((area, file_name, student_id, concept, question_no, digest, size))
+
+        return pd.DataFrame(rows, columns=storage.columns)
+
+
+    def add(area, files):
+
+        # (file name, bytes) pairs of one area, returns the blob path of every file
+        blobs = [(file_name, storage.put(data), len(data)) for file_name, data in files]
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            # A sheet uploaded again under the same name points to its new blob
+            sql.bulk_load(cursor, 'answer_sheet_file', storage.columns, storage.rows(area, blobs),
+                          key=['area', 'file_name'], update=True)
+            connection.commit()
+
+            return [storage.blob_path(digest) for _, digest, _ in blobs]
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def remove(area, file_names):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            # Only the index rows, the blobs may be shared with other areas
+            cursor.execute(f'''delete from answer_sheet_file
+                               where area=%s and file_name = any(%s);''', (area, list(file_names)))
+            connection.commit()
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def move(area, target, file_names):
+
+        # Sheets of one area into another, only their index rows change. Returns the blob of every moved sheet.
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f'''with moved as (
+                                   delete from answer_sheet_file
+                                   where area=%s and file_name = any(%s)
+                                   returning file_name, student_id, concept, question_no, blob, size)
+                               insert into answer_sheet_file(area, file_name, student_id, concept, question_no, blob, size)
+                               select %s, file_name, student_id, concept, question_no, blob, size from moved
+                               on conflict (area, file_name) do update set blob=excluded.blob, size=excluded.size
+                               returning file_name, blob;''', (area, list(file_names), target))
+            blobs = dict(cursor.fetchall())
+            connection.commit()
+
+            return blobs
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def files(area):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f'''select file_name, student_id, concept, question_no, blob
+                               from answer_sheet_file
+                               where area=%s
+                               order by student_id, concept, question_no;''', (area,))
+
+            return pd.DataFrame(cursor.fetchall(), columns=['file_name', 'student_id', 'concept', 'question_no', 'blob'])
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def import_folders(cursor):
+
+        # Result/handwriting/matched/concepts/<concept>/<answer sheet>, Result/handwriting/mismatched/<answer sheet>
+        # and Result/teacher/<answer sheet>. Sheets already in the index are kept, the store is newer than the folders.
+        folders = [('matched', os.path.join(catalog.root, concept)) for concept in os.listdir(catalog.root)] \
+                  if os.path.isdir(catalog.root) else []
+        folders += [(area, root) for area, root in storage.legacy_roots.items() if os.path.isdir(root)]
+
+        rows, paths = [], []
+        for area, folder in folders:
+            blobs = []
+            for file_name in os.listdir(folder):
+                # Only answer sheets, not the temporary files of an interrupted write
+                try:
+                    catalog.parse(file_name)
+                except (IndexError, ValueError):
+                    continue
+
+                path = os.path.join(folder, file_name)
+                if not file_name.endswith('.tmp'):
+                    blobs.append((file_name, storage.put_file(path), os.path.getsize(path)))
+                    paths.append(path)
+
+            rows.append(storage.rows(area, blobs))
+
+        # New index rows and the imported files, retired by the caller once the rows are committed
+        return sql.bulk_load(cursor, 'answer_sheet_file', storage.columns, rows, key=['area', 'file_name']), paths
+
+
+    def retire(paths):
+
+        # The imported files live on in their blobs (hard links or copies). Without them a later import would
+        # bring back the teacher and mismatched sheets verified or removed since, files that are not answer sheets stay.
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        for folder in {os.path.dirname(path) for path in paths}:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass
+
+
+
+class catalog:
+
+    # Catalog of the matched answer sheets and of the sheets every evaluator has finished, the path of a sheet
+    # is its blob in the storage. The evaluation page reads its next sheet and the pending
+    # count with indexed queries (sql.statements) instead of listing and comparing the folders on every rerun.
+    # Evaluations are only rows in answer_sheet_evaluation, Result/evaluation holds the copies older versions
+    # saved to mark a sheet as evaluated (imported by 'python app.py import-evaluations' and after every migration run).
+
+    root = os.path.join('Result','handwriting','matched','concepts')
+    evaluation_root = os.path.join('Result','evaluation')
+
+    columns = ['concept', 'file_name', 'student_id', 'question_no', 'path']
+
+
+    def parse(file_name):
+
+        # Ex: ST01_machine learning_Q101.jpeg ---> ('ST01', 'machine learning', 101)
+        parts = file_name.split('.')[0].split('_')
+        return parts[0], parts[1], int(parts[-1].replace('Q', ''))
+
+
+    def sheet_rows(sheets):
+
+        # (concept, file name, path) to catalog rows, files that are not named like an answer sheet are skipped
+        rows = []
+        for concept, file_name, path in sheets:
+            try:
+                student_id, _, question_no = catalog.parse(file_name)
+            except (IndexError, ValueError):
+                continue
+
+            rows.append((concept, file_name, student_id, question_no, path))
+
+        return pd.DataFrame(rows, columns=catalog.columns)
+
+
+    def stored_sheets(cursor):
+
+        cursor.execute(f'''select concept, file_name, blob from answer_sheet_file
+                           where area='matched';''')
+
+        return catalog.sheet_rows((concept, file_name, storage.blob_path(blob))
+                                  for concept, file_name, blob in cursor.fetchall())
+
+
+    def scan_evaluations():
+
+        # Result/evaluation/<evaluator>/<concept>/<answer sheet>
+        os.makedirs(catalog.evaluation_root, exist_ok=True)
+        rows = [(evaluator_id, concept, file_name)
+                for evaluator_id in os.listdir(catalog.evaluation_root)
+                for concept in os.listdir(os.path.join(catalog.evaluation_root, evaluator_id))
+                for file_name in os.listdir(os.path.join(catalog.evaluation_root, evaluator_id, concept))]
+
+        return pd.DataFrame(rows, columns=['evaluator_id', 'concept', 'file_name'])
+
+
+    def add_sheets(cursor, sheets):
+
+        # A sheet uploaded again under the same name keeps its evaluations
+        return sql.bulk_load(cursor, 'answer_sheet', catalog.columns, sheets, key=['concept', 'file_name'], update=True)
+
+
+    def add_evaluations(cursor, evaluations, sheets):
+
+        # Only evaluations of catalogued sheets
+        evaluations = evaluations.merge(sheets[['concept', 'file_name']], on=['concept', 'file_name'])
+        return sql.bulk_load(cursor, 'answer_sheet_evaluation', ['evaluator_id', 'concept', 'file_name'], evaluations,
+                             key=['evaluator_id', 'concept', 'file_name'])
+
+
+    def import_folders():
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            # One import at a time (server processes starting together), a second one would hash the files
+            # the first is retiring. A session lock, held until the files are gone and not only until the commit.
+            cursor.execute(f'''select pg_advisory_lock(hashtext('import_folders'));''')
+
+            try:
+                # Idempotent, the sheet files go into the storage first and evaluations already in the catalog are kept
+                file_count, paths = storage.import_folders(cursor)
+                sheets = catalog.stored_sheets(cursor)
+                catalog.add_sheets(cursor, sheets)
+                evaluation_count = catalog.add_evaluations(cursor, catalog.scan_evaluations(), sheets)
+                cache.publish(cursor, 'answer_sheet')
+                connection.commit()
+
+                # Only after the commit, a failed import keeps its files for the next run
+                storage.retire(paths)
+
+            finally:
+                connection.rollback()
+                cursor.execute(f'''select pg_advisory_unlock(hashtext('import_folders'));''')
+                connection.commit()
+
+            cache.invalidate('answer_sheet')
+            return file_count, evaluation_count
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def add(sheets):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            catalog.add_sheets(cursor, catalog.sheet_rows(sheets))
+            cache.publish(cursor, 'answer_sheet')
+            connection.commit()
+
+            # New concepts in the role and upload dropdowns
+            cache.invalidate('answer_sheet')
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def next_pending(evaluator_id, concept, count=1):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            # The next 'count' sheets in question order without an evaluation by this evaluator, and the pending count
+            sql.execute_prepared(cursor, 'next_answer_sheets', (concept, evaluator_id, count))
+            sheets = cursor.fetchall()
+
+            sql.execute_prepared(cursor, 'pending_answer_sheets', (concept, evaluator_id))
+            pending = cursor.fetchone()[0]
+
+            return sheets, pending
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def mark_evaluated(evaluator_id, concept, file_name):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f'''insert into answer_sheet_evaluation(evaluator_id, concept, file_name)
+                               values(%s, %s, %s)
+                               on conflict do nothing;''', (evaluator_id, concept, file_name))
+            connection.commit()
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+
+class disk_cache:
+
+    # Size caps of the derived files under Cache. Samples and preview renditions can always be made again from their
+    # source, so once a folder grows over its limit the least recently written files are removed. Every process scans
+    # a folder on its first write there (once per rerun of the Streamlit script) and then adds up what it writes.
+    # Only plain module state, the writers also run in worker threads without a Streamlit session.
+
+    sizes = {}
+    lock = threading.Lock()
+
+
+    def prune(folder, limit):
+
+        files, total = [], 0
+        for path, _, file_names in os.walk(folder):
+            for file_name in file_names:
+                # Files in the middle of a write are left alone
+                if file_name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(path, file_name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(path, file_name)))
+                total += stat.st_size
+
+        # Down to 90% of the limit, so the next writes do not prune again right away
+        if total > limit:
+            for _, size, path in sorted(files):
+                if total <= 0.9 * limit:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+        return total
+
+
+    def added(folder, size, max_mb):
+
+        # Called after writing 'size' bytes into 'folder'
+        limit = max_mb * 2 ** 20
+
+        with disk_cache.lock:
+            total = disk_cache.sizes.get(folder)
+            if total is not None and total + size <= limit:
+                disk_cache.sizes[folder] = total + size
+            else:
+                disk_cache.sizes[folder] = disk_cache.prune(folder, limit)
+
+
+
+class preview:
+
+    # WebP renditions of the answer sheets at fixed widths, created once when a sheet is ingested. The file name
+    # is a hash of the sheet path, mtime and size, so a sheet uploaded again gets new renditions. The evaluation
+    # page reads them through a process-wide LRU of encoded bytes and prefetches the evaluator's next sheets.
+    # The folder is capped at PREVIEW_CACHE_MAX_MB, a pruned rendition is created again when it is next viewed.
+
+    root = os.path.join('Cache', 'previews')
+    widths = (900, 1800)
+
+
+    @st.cache_resource
+    def store():
+        return {'entries': {}, 'lock': threading.Lock()}
+
+
+    @st.cache_resource
+    def executor():
+        return ThreadPoolExecutor(max_workers=2, thread_name_prefix='previews')
+
+
+    def path(sheet_path, width):
+
+        stat = os.stat(sheet_path)
+        key = hashlib.sha1(f'{os.path.abspath(sheet_path)}|{stat.st_mtime_ns}|{stat.st_size}'.encode('utf-8')).hexdigest()
+
+        # Two level fan-out keeps the folders small
+        return os.path.join(preview.root, key[:2], f'{key}_{width}.webp')
+
+
+    def create(image, sheet_path):
+
+        # Every width from the already decoded image, largest first so each resize starts from a smaller image
+        image = image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+        size = 0
+        for width in sorted(preview.widths, reverse=True):
+            if image.width > width:
+                image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+            path = preview.path(sheet_path, width)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Written under a temporary name, a concurrent reader never sees a partial file
+            temp_path = f'{path}.{threading.get_ident()}.tmp'
+            # method 2: half the encoding time of the default 4 for a few percent larger files
+            image.save(temp_path, format='WEBP', quality=int(os.getenv('PREVIEW_QUALITY', 80)), method=2)
+            os.replace(temp_path, path)
+            size += os.path.getsize(path)
+
+        disk_cache.added(preview.root, size, float(os.getenv('PREVIEW_CACHE_MAX_MB', 1024)))
+
+
+    def render(sheet_path):
+
+        with Image.open(sheet_path) as image:
+            preview.create(image, sheet_path)
+
+
+    def load(sheet_path, width=900, store=None):
+
+        # The prefetch threads pass the store, they have no Streamlit session to resolve it
+        store = preview.store() if store is None else store
+        key = (sheet_path, width)
+
+        with store['lock']:
+            data = store['entries'].pop(key, None)
+            if data is not None:
+                # Most recently used at the end
+                store['entries'][key] = data
+                return data
+
+        path = preview.path(sheet_path, width)
+
+        # Sheets ingested before the renditions existed get them on first view
+        if not os.path.exists(path):
+            preview.render(sheet_path)
+
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        with store['lock']:
+            store['entries'][key] = data
+
+            # Evict the least recently used renditions beyond the size limit
+            while len(store['entries']) > int(os.getenv('PREVIEW_CACHE_ENTRIES', 64)):
+                del store['entries'][next(iter(store['entries']))]
+
+        return data
+
+
+    def prefetch(sheet_paths, width=900):
+
+        # Load the next sheets into the LRU in the background, a missing file only skips its prefetch.
+        # The store and the executor are resolved here in the script thread, the workers only run plain functions
+        store, executor = preview.store(), preview.executor()
+        for sheet_path in sheet_paths:
+            executor.submit(preview.load, sheet_path, width, store)
+
+
+
+class model_registry:
+
+    # Inference artifacts (the Keras writer-identification model and its quantized TFLite exports), loaded
+    # once per server process and shared by every session. Every lookup stats the file, a new mtime or size
+    # (e.g. after teacher.model_training) is checked against the file hash and only a changed file is loaded again.
+
+    # Every training run saves a bundle folder Model/bundles/<version> with the weights (model.h5) and a manifest:
+    # the writer labels in output order, the input size and the pixel normalization. Model/current.json names
+    # the bundle in use and is replaced in one step, so the weights and labels always switch together.
+    bundles_path = os.path.join('Model', 'bundles')
+    pointer_path = os.path.join('Model', 'current.json')
+    bundles_kept = 3
+
+    # Model saved before bundles, used while no bundle exists
+    path = os.path.join('Model', 'trained_model.h5')
+    writers_path = os.path.join('Model', 'writers.json')
+
+
+    @st.cache_resource
+    def store():
+        return {'entries': {}, 'lock': threading.Lock()}
+
+
+    def file_hash(path):
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(partial(file.read, 1024 * 1024), b''):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+
+    def load(path, loader):
+
+        store = model_registry.store()
+
+        # Raises FileNotFoundError (an OSError) until the artifact exists
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = store['entries'].get(path)
+        if entry is None or entry['signature'] != signature:
+            with store['lock']:
+                entry = store['entries'].get(path)
+                if entry is None or entry['signature'] != signature:
+                    version = model_registry.file_hash(path)[:12]
+
+                    if entry is None or version != entry['version']:
+                        start = time.perf_counter()
+                        value = loader(path)
+                        entry = {'version': version, 'value': value,
+                                 'load_time': round(time.perf_counter() - start, 3),
+                                 'loaded_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+                    store['entries'][path] = dict(entry, signature=signature)
+                    entry = store['entries'][path]
+
+        return entry['value']
+
+
+    def load_keras(path):
+
+        from tensorflow.keras import models
+        from tensorflow.keras.models import load_model
+
+        model = load_model(path)
+
+        # Embedding model: every layer up to the one before the softmax head. Its weights
+        # hash versions the centroid index, so training only the head keeps the centroids valid
+        backbone = models.Model(inputs=model.inputs, outputs=model.layers[-2].output)
+        backbone_hash = hashlib.sha256()
+        for weights in backbone.get_weights():
+            backbone_hash.update(weights.tobytes())
+
+        return {'model': model, 'backbone': backbone, 'backbone_version': backbone_hash.hexdigest()[:12]}
+
+
+    def load_manifest(pointer_path):
+
+        with open(pointer_path) as file:
+            bundle = json.load(file)['bundle']
+
+        folder = os.path.join(model_registry.bundles_path, bundle)
+        with open(os.path.join(folder, 'manifest.json')) as file:
+            manifest = dict(json.load(file), path=os.path.join(folder, 'model.h5'))
+
+        # Drop the artifacts of the previous bundles, predictions still running on them keep their own reference
+        entries = model_registry.store()['entries']
+        for path in [p for p in list(entries) if p.startswith(model_registry.bundles_path + os.sep) and
+                     not p.startswith(folder + os.sep)]:
+            entries.pop(path, None)
+
+        return manifest
+
+
+    def legacy_manifest():
+
+        # Labels of a model saved before bundles: the writers file, or the folder order before that file existed
+        try:
+            with open(model_registry.writers_path) as file:
+                writers = json.load(file)
+        except FileNotFoundError:
+            writers = os.listdir(os.path.join('Dataset','images'))
+
+        return {'version': 'legacy', 'writers': writers, 'input_size': [128, 128],
+                'normalization': {'mean': 0.0, 'std': 255.0}, 'path': model_registry.path}
+
+
+    def manifest():
+
+        # Manifest of the bundle in use, read once per bundle. 'path' is its Keras model file
+        try:
+            return model_registry.load(model_registry.pointer_path, model_registry.load_manifest)
+        except FileNotFoundError:
+            return model_registry.legacy_manifest()
+
+
+    def get(manifest=None):
+        manifest = manifest or model_registry.manifest()
+        return model_registry.load(manifest['path'], model_registry.load_keras)['model']
+
+
+    def backbone():
+        return model_registry.load(model_registry.manifest()['path'], model_registry.load_keras)['backbone']
+
+
+    def backbone_version():
+        return model_registry.load(model_registry.manifest()['path'], model_registry.load_keras)['backbone_version']
+
+
+    def save_bundle(model, manifest):
+
+        # Write the bundle under a temporary name, then point current.json at it
+        version = f'{time.strftime("%Y%m%d-%H%M%S")}-{secrets.token_hex(3)}'
+        folder = os.path.join(model_registry.bundles_path, version)
+        temp_folder = f'{folder}.tmp'
+        os.makedirs(temp_folder)
+
+        model.save(os.path.join(temp_folder, 'model.h5'))
+        with open(os.path.join(temp_folder, 'manifest.json'), 'w') as file:
+            json.dump(dict(manifest, version=version, created_at=time.strftime('%Y-%m-%d %H:%M:%S')), file, indent=2)
+        os.rename(temp_folder, folder)
+
+        temp_path = f'{model_registry.pointer_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'bundle': version}, file)
+        os.replace(temp_path, model_registry.pointer_path)
+
+        # Keep the newest bundles, a session may still be predicting with the previous one
+        for old in sorted(os.listdir(model_registry.bundles_path))[:-model_registry.bundles_kept]:
+            shutil.rmtree(os.path.join(model_registry.bundles_path, old), ignore_errors=True)
+
+        return version
+
+
+    def tflite_path(quantization, manifest=None):
+
+        # Next to the Keras model, e.g. Model/bundles/<version>/model_int8.tflite
+        manifest = manifest or model_registry.manifest()
+        return f'{os.path.splitext(manifest["path"])[0]}_{quantization}.tflite'
+
+
+    def load_tflite(path):
+
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        # An interpreter is not thread-safe, every invoke holds its lock
+        interpreter = Interpreter(model_path=path, num_threads=int(os.getenv('INFERENCE_THREADS', os.cpu_count() or 1)))
+        return {'interpreter': interpreter, 'lock': threading.Lock(), 'batch_size': None}
+
+
+    def interpreter(quantization, manifest=None):
+        return model_registry.load(model_registry.tflite_path(quantization, manifest), model_registry.load_tflite)
+
+
+    def info():
+
+        entries = model_registry.store()['entries']
+        return [{'path': path, 'version': entry['version'], 'loaded_at': entry['loaded_at'],
+                 'load_time (s)': entry['load_time']} for path, entry in list(entries.items())]
+
+
+
+class training_job:
+
+    # Model training runs in a worker process (python app.py train ...), so a teacher's session stays responsive
+    # and a browser refresh does not stop it. Only one job runs at a time: the worker holds an exclusive lock on
+    # lock_path for its lifetime. It writes its stage and per-epoch metrics to the status file, the teacher tab polls it.
+
+    status_path = os.path.join('Cache', 'training_job.json')
+    lock_path = os.path.join('Cache', 'training_job.lock')
+    cancel_path = os.path.join('Cache', 'training_job.cancel')
+    log_path = os.path.join('Cache', 'training_job.log')
+
+
+    class cancelled(Exception):
+        pass
+
+
+    @st.cache_resource
+    def store():
+        return {'lock': threading.Lock()}
+
+
+    def lock(file):
+
+        # Non-blocking exclusive lock, released when the file is closed or the process exits.
+        # Raises OSError while another process holds it
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+    def running():
+
+        os.makedirs(os.path.dirname(training_job.lock_path), exist_ok=True)
+        with open(training_job.lock_path, 'a') as file:
+            try:
+                training_job.lock(file)
+            except OSError:
+                return True
+
+        return False
+
+
+    def status():
+
+        try:
+            with open(training_job.status_path) as file:
+                status = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # A worker that was killed or crashed leaves a queued or running status without holding the lock.
+        # A queued job gets a minute to start up and take the lock
+        if status['state'] in ('queued', 'running') and not training_job.running():
+            if status['state'] == 'running' or time.time() - status['updated'] > 60:
+                status = dict(status, state='failed', error=f'The training process exited unexpectedly, see {training_job.log_path}')
+
+        return status
+
+
+    def write_status(status):
+
+        # Readers never see a partial file
+        os.makedirs(os.path.dirname(training_job.status_path), exist_ok=True)
+        temp_path = f'{training_job.status_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(dict(status, updated=time.time()), file)
+        os.replace(temp_path, training_job.status_path)
+
+
+    def start(mode, student_id=None):
+
+        # Returns the job id, or None when a job is already queued or running
+        with training_job.store()['lock']:
+            status = training_job.status()
+            if training_job.running() or (status is not None and status['state'] == 'queued'):
+                return None
+
+            job_id = secrets.token_hex(4)
+            if os.path.exists(training_job.cancel_path):
+                os.remove(training_job.cancel_path)
+
+            training_job.write_status({'job': job_id, 'mode': mode, 'student_id': student_id, 'state': 'queued',
+                                       'stage': 'Starting the training process', 'epoch': 0, 'epochs': None,
+                                       'history': [], 'accuracy': None, 'error': None,
+                                       'started_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'finished_at': None})
+
+            arguments = [sys.executable, os.path.abspath(__file__), 'train', job_id, mode] + ([student_id] if student_id else [])
+            with open(training_job.log_path, 'w') as log:
+                subprocess.Popen(arguments, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                 start_new_session=True)
+
+        return job_id
+
+
+    def cancel():
+
+        # The worker checks for the file after every training batch and before every stage
+        with open(training_job.cancel_path, 'w') as file:
+            file.write(time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+    def cancel_requested():
+        return os.path.exists(training_job.cancel_path)
+
+
+    def keras_callback(progress, stage, epochs):
+
+        from tensorflow.keras.callbacks import Callback
+
+        class callback(Callback):
+
+            def on_train_batch_end(self, batch, logs=None):
+                if training_job.cancel_requested():
+                    self.model.stop_training = True
+
+            def on_epoch_end(self, epoch, logs=None):
+                progress(stage, epoch + 1, epochs, {name: round(float(value), 4) for name, value in (logs or {}).items()})
+
+        return callback()
+
+
+    def log(stage, epoch=None, epochs=None, metrics=None):
+
+        # Progress of a training run outside a job (benchmarks)
+        print(stage if epoch is None else f'{stage}: epoch {epoch}/{epochs} {metrics}')
+
+
+    def run(job_id, mode, student_id=None):
+
+        # Worker process: python app.py train <job id> full|enroll|centroid [student id]
+        os.makedirs(os.path.dirname(training_job.lock_path), exist_ok=True)
+        with open(training_job.lock_path, 'a') as lock_file:
+            try:
+                training_job.lock(lock_file)
+            except OSError:
+                print('Another training job is running')
+                return 1
+
+            status = training_job.status() or {}
+            if status.get('job') != job_id:
+                print(f'Training job {job_id} is not the queued job')
+                return 1
+
+            status.update(state='running', pid=os.getpid())
+            training_job.write_status(status)
+
+            def progress(stage, epoch=None, epochs=None, metrics=None):
+                if training_job.cancel_requested():
+                    raise training_job.cancelled()
+
+                status.update(stage=stage)
+                if epoch is not None:
+                    status.update(epoch=epoch, epochs=epochs)
+                    status['history'].append(dict(stage=stage, epoch=epoch, **metrics))
+                training_job.write_status(status)
+                training_job.log(stage, epoch, epochs, metrics)
+
+            try:
+                if mode == 'centroid':
+                    teacher.enroll_centroid(student_id, progress)
+                    status.update(state='completed', stage='Centroids saved')
+
+                else:
+                    # The centroids in use are computed again when the new model changed the backbone
+                    centroids_used = os.path.exists(teacher.centroids_path) or os.getenv('VERIFICATION_ENGINE') == 'Nearest Centroid'
+
+                    # The quantized copies in use are exported again for the new bundle
+                    quantizations = [q for q in ('float16', 'int8') if os.getenv('INFERENCE_BACKEND') == q or
+                                     os.path.exists(model_registry.tflite_path(q))]
+
+                    if mode == 'full':
+                        accuracy = teacher.model_training(progress)
+                    else:
+                        accuracy = teacher.enroll_writer(student_id, progress)
+
+                    if centroids_used and teacher.centroid_index() is None:
+                        teacher.enroll_centroid(progress=progress)
+
+                    for quantization in quantizations:
+                        progress(f'Exporting the {quantization} model')
+                        teacher.export_quantized(quantization)
+
+                    status.update(state='completed', stage='Model saved', accuracy=float(accuracy))
+
+            except training_job.cancelled:
+                status.update(state='cancelled', stage=f'Cancelled while {status["stage"].lower()}')
+
+            except Exception as e:
+                status.update(state='failed', error=str(e))
+                raise
+
+            finally:
+                status.update(finished_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+                training_job.write_status(status)
+                if os.path.exists(training_job.cancel_path):
+                    os.remove(training_job.cancel_path)
+
+        return 0
+
+
+
+class admin:
+
+    def account_login(role):
+
+        # Already logged in for this page, no database or bcrypt work on reruns
+        record = session.current(role)
+
+        if record is not None:
+
+            col1, col2, col3, col4 = st.columns([0.1, 0.6, 0.2, 0.1], gap='medium')
+
+            with col2:
+                st.markdown(f'<h5 style="color: green;">Logged in as {record["user_id"]}</h5>', unsafe_allow_html=True)
+
+            with col3:
+                logout = st.button(label='LogOut')
+
+            if logout:
+                session.end()
+                # Trigger a rerun to Refresh the Page
+                st.experimental_rerun()
+
+            return record['user_id'], 'LogIn Successfully'
+
+        col1, col2, col3, col4 = st.columns([0.1, 0.4, 0.4, 0.1], gap='medium')
+
+        with col2:
+            user_id = st.text_input(label='User ID')
+
+        with col3:
+            password = st.text_input(label='Password', type='password')
+
+        if user_id == '' and password == '':
+
+            add_vertical_space(1)
+            col1, col2, col3, col4 = st.columns([0.1, 0.4, 0.4, 0.1], gap='medium')
+
+            with col2:
+                st.markdown(f'<h5 style="color: orange;">Please Enter User ID and Password</h5>',
+                            unsafe_allow_html=True)
+
+
+        elif user_id != '' and password != '':
+
+            add_vertical_space(1)
+            col1, col2, col3, col4 = st.columns([0.1, 0.4, 0.4, 0.1], gap='medium')
+
+            with col2:
+                status = sql.login_credentials_verification(user_id, password, role)
+
+            if status == 'LogIn Successfully':
+                session.create(user_id, role)
+
+            return user_id, status
+
+
+    def view_user():
+
+        # (user_id, role) is the primary key, so both sort orders are unique
+        pagination.view(name='admin_view_user',
+                        query=f'''select user_id, role from login_credentials''', params=[],
+                        sort_options={'User ID': ['user_id', 'role'], 'Role': ['role', 'user_id']})
+
+
+    def add_user():
+        
+        add_vertical_space(1)
+        try:
+            with st.form('Add User'):
                 add_vertical_space(1)
                 col4, col5, col6 = st.columns([0.3, 0.3, 0.4], gap='medium')
 
@@ -660,15 +2158,15 @@ class admin:
                     password = st.text_input(label='Password ', type='password')
 
                 with col6:
-                    # Create the target folder if it doesn't exist
-                    os.makedirs(os.path.join('Result','handwriting','matched','concepts'), exist_ok=True)
+                    # Concepts with matched answer sheets in the catalog
+                    concepts = teacher.distinct_values('answer_sheet', 'concept')
 
-                    # Check Subfolders inside the concepts folder or not
-                    if len(os.listdir(os.path.join('Result','handwriting','matched','concepts')))==0:
+                    # Check Concepts in the catalog or not
+                    if len(concepts)==0:
                         option = ['admin', 'teacher', 'student']
                     else:
                         option = ['admin', 'teacher', 'student'] +\
-                                 [f'assistant - {i}' for i in os.listdir(os.path.join('Result','handwriting','matched','concepts'))]
+                                 [f'assistant - {i}' for i in concepts]
                                 
                     # Get User Input 
                     role = st.selectbox(label='Role ', options=option)
@@ -695,25 +2193,77 @@ class admin:
 
             if login_data_file is not None and add_users:
                 add_vertical_space(1)
-                with st.spinner('Processing...'):
-                    # Verify the File Type for Reading method
-                    if login_data_file.name.endswith('.csv'):
-                        df = pd.read_csv(login_data_file)
+                progress = st.progress(0.0, text='Processing...')
+
+                # bcrypt cost factor for bulk imports, can be lowered for large cohorts
+                rounds = int(os.getenv('BCRYPT_BULK_ROUNDS', 12))
+                chunk_size = int(os.getenv('BULK_IMPORT_CHUNK_SIZE', 500))
+
+                # Check the whole file before anything is written, chunk by chunk so it is never held in memory.
+                # Skipped and listed by their row number in the file: rows with an empty User ID, Password or Role
+                # and rows repeating the User ID and Role of an earlier row
+                empty, repeated, keys, total = [], [], set(), 0
+                for df in sql.read_upload(login_data_file, chunksize=chunk_size):
+                    rows = np.arange(total, total + len(df)) + 2
+                    total += len(df)
+
+                    is_empty = (df[['user_id', 'password', 'role']].apply(lambda column: column.str.strip()) == '').any(axis=1).values
+                    empty.extend(rows[is_empty].tolist())
 
-                    elif login_data_file.name.endswith('.xlsx'):
-                        df = pd.read_excel(login_data_file)
+                    for row, user_id, role in zip(rows[~is_empty], df['user_id'][~is_empty], df['role'][~is_empty]):
+                        if (user_id, role) in keys:
+                            repeated.append(row)
+                        else:
+                            keys.add((user_id, role))
 
-                    # Encoded to Password into Hashed Password and Stored in New Column
-                    df['password'] = df['password'].apply(lambda x: sql.encode_password(x))
+                # Users that already have an account are skipped and listed too, their passwords are never hashed
+                existing = sql.existing_users(keys)
+                skipped_rows = set(empty) | set(repeated)
 
-                    # Migrate the Data to SQL table
-                    sql.add_multiple_user_login_credentials_table(df)
+                def chunks():
+
+                    login_data_file.seek(0)
+                    processed = 0
+                    for df in sql.read_upload(login_data_file, chunksize=chunk_size):
+                        rows = np.arange(processed, processed + len(df)) + 2
+                        processed += len(df)
+
+                        new_user = [row not in skipped_rows and (user_id, role) not in existing
+                                    for row, user_id, role in zip(rows, df['user_id'], df['role'])]
+                        df = df.loc[new_user, ['user_id', 'password', 'role']].copy()
+
+                        # Encoded to Password into Hashed Password across the worker threads
+                        df['password'] = sql.encode_passwords(df['password'], rounds)
+
+                        progress.progress(processed / max(total, 1), text=f'{processed} Users Processed')
+                        yield df
+
+                # Migrate the Data to SQL table in one transaction
+                try:
+                    added = sql.add_multiple_user_login_credentials_table(chunks())
+
+                except Exception as e:
+                    st.markdown(f'<h5 style="text-position:center;color:orange;">No Users Added: {e}</h5>', unsafe_allow_html=True)
+                    return
 
                 # Display the Success Message
-                st.markdown(f'<h5 style="text-position:center;color:green;">Users Added Successfully</h5>', unsafe_allow_html=True)
-                
-                # Trigger a rerun to Refresh the Page
-                st.experimental_rerun()
+                st.markdown(f'<h5 style="text-position:center;color:green;">{added} Users Added Successfully</h5>', unsafe_allow_html=True)
+
+                listed = lambda items: ', '.join(str(i) for i in items[:20]) + (' ...' if len(items) > 20 else '')
+                if empty:
+                    st.markdown(f'<h5 style="text-position:center;color:orange;">{len(empty)} Rows Skipped, User ID, Password or Role is Empty (Rows: {listed(empty)})</h5>',
+                                unsafe_allow_html=True)
+                if repeated:
+                    st.markdown(f'<h5 style="text-position:center;color:orange;">{len(repeated)} Rows Skipped, User ID and Role Repeat an Earlier Row (Rows: {listed(repeated)})</h5>',
+                                unsafe_allow_html=True)
+                if existing:
+                    existing = sorted(f'{user_id} ({role})' for user_id, role in existing)
+                    st.markdown(f'<h5 style="text-position:center;color:orange;">{len(existing)} Users Skipped, they Already Exist: {listed(existing)}</h5>',
+                                unsafe_allow_html=True)
+
+                if not (empty or repeated or existing):
+                    # Trigger a rerun to Refresh the Page
+                    st.experimental_rerun()
         
 
         except Exception as e:
@@ -738,250 +2288,752 @@ class admin:
                 with col8:
                     password = st.text_input(label='Password ', type='password')
 
-                with col9:
-                    # Create the target folder if it doesn't exist
-                    os.makedirs(os.path.join('Result','handwriting','matched','concepts'), exist_ok=True)
+                with col9:
+                    # Concepts with matched answer sheets in the catalog
+                    concepts = teacher.distinct_values('answer_sheet', 'concept')
+
+                    # Check Concepts in the catalog or not
+                    if len(concepts)==0:
+                        option = ['admin', 'teacher', 'student']
+                    else:
+                        option = ['admin', 'teacher', 'student'] +\
+                                [f'assistant - {i}' for i in concepts] +\
+                                [f'supersub - {i}' for i in concepts] + ['inactive']
+
+                    # Get User Input 
+                    role = st.selectbox(label='Role ', options=option)
+
+            if update_user and password != '':
+                add_vertical_space(1)
+                sql.update_user_login_credentials_table(user_id, password, role)
+
+        except Exception as e:
+            add_vertical_space(2)
+            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+
+
+    def get_role_delete_user(user_id):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f'''select role from login_credentials
+                               where user_id = '{user_id}' 
+                               order by role;''')
+
+            result = cursor.fetchall()
+
+            role_list = [i[0] for i in result]
+
+            return role_list
+
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
+
+
+    def delete_user():
+
+        try:
+            add_vertical_space(1)
+            col10, col11 = st.columns([0.5, 0.5], gap='medium')
+
+            with col10:
+                user_id = st.selectbox(label='User ID   ', options=sql.user_id())
+                add_vertical_space(1)
+                delete_user = st.button(label='Delete User')
+                add_vertical_space(1)
+
+            with col11:
+                role = st.selectbox(label='Role   ', options=admin.get_role_delete_user(user_id))
+
+            if delete_user:
+                add_vertical_space(1)
+                sql.delete_user_login_credentials_table(user_id, role=role)
+
+        except Exception as e:
+            add_vertical_space(2)
+            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+
+
+    def main():
+
+        try:
+            user_id, login_status = admin.account_login(role='admin')
+
+            if login_status == 'LogIn Successfully':
+                add_vertical_space(2)
+
+                col1, col2, col3 = st.columns([0.1, 0.8, 0.1], gap='medium')
+
+                with col2:
+                    tab1, tab2, tab3, tab4 = st.tabs(['View User', 'Add User', 'Update User', 'Delete User'])
+
+                    with tab1:
+                        add_vertical_space(1)
+                        admin.view_user()
+
+                        # Connection Pool Counters
+                        add_vertical_space(1)
+                        with st.expander(label='Connection Pool:'):
+                            st.dataframe(pd.DataFrame([sql.pool().stats()]))
+
+                    with tab2:
+                        # Add Single User Data in SQL Table
+                        add_vertical_space(2)
+                        st.markdown(f'<h4 style="color:orange;">Add Single User:</h4>', unsafe_allow_html=True)
+                        admin.add_user()
+
+                        # Add Multiple Users Data in SQL Table
+                        add_vertical_space(2)
+                        st.markdown(f'<h4 style="color:orange;">Add Multiple Users:</h4>', unsafe_allow_html=True)
+                        admin.add_multiple_users()
+
+                    with tab3:
+                        add_vertical_space(1)
+                        admin.update_user()
+
+                    with tab4:
+                        add_vertical_space(1)
+                        admin.delete_user()
+
+        except TypeError:
+            pass
+
+
+
+class teacher:
+
+    # Model input size (width, height) and pixel normalization (pixel - mean) / std of training,
+    # saved in every model bundle so inference preprocesses the same way
+    input_size = (128, 128)
+    normalization = {'mean': 0.0, 'std': 255.0}
+
+    # Decoded and resized samples, kept across training runs up to SAMPLE_CACHE_MAX_MB
+    sample_cache = os.path.join('Cache', 'samples')
+
+
+    # Worker threads for image decoding, cv2 releases the GIL while it decodes and resizes
+    @st.cache_resource
+    def image_executor():
+        return ThreadPoolExecutor(max_workers=int(os.getenv('IMAGE_WORKERS', os.cpu_count() or 1)),
+                                  thread_name_prefix='images')
+
+
+    # Function to load and preprocess one image, from the sample cache when the file is unchanged
+    def load_image(image_path, size=(128, 128)):
+
+        import cv2
+
+        stat = os.stat(image_path)
+        key = f'{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}'
+        cache_path = os.path.join(teacher.sample_cache, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+        try:
+            return np.load(cache_path)
+        except (OSError, ValueError):
+            pass
+
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+
+        try:
+            image = cv2.resize(image, size)
+        except:
+            return None
+
+        # Write to a temporary file first so a concurrent run never reads a partial sample
+        os.makedirs(teacher.sample_cache, exist_ok=True)
+        temp_path = f'{cache_path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, image)
+        os.replace(temp_path, cache_path)
+
+        disk_cache.added(teacher.sample_cache, os.path.getsize(cache_path), float(os.getenv('SAMPLE_CACHE_MAX_MB', 2048)))
+
+        return image
+
+
+    # Function to load and preprocess images from a folder
+    def load_images(folder_path):
+
+        image_paths = [os.path.join(folder_path, file_name) for file_name in os.listdir(folder_path)]
+
+        # Decode in parallel, map keeps the listdir order; unreadable files are skipped
+        images = teacher.image_executor().map(teacher.load_image, image_paths)
+
+        return [image for image in images if image is not None]
+
+
+    # uint8 training images, memory-mapped so a training run never holds the whole dataset in RAM. Every call
+    # writes its own file (Cache/training_images-<random>.u8): the training worker and the server may build
+    # datasets at the same time, and truncating a file under another reader's memory map kills that process
+    training_images = os.path.join('Cache', 'training_images')
+
+
+    def remove_training_images(path=None):
+
+        # The file of one call, or else the files left by calls that crashed and the one shared file of older
+        # versions (untouched for an hour). Windows refuses to remove a file that is still mapped, a later call removes it
+        if path is None:
+            folder, prefix = os.path.split(teacher.training_images)
+            paths = [os.path.join(folder, i) for i in os.listdir(folder) if i.startswith(prefix) and i.endswith('.u8')]
+        else:
+            paths = [path]
+
+        for old_path in paths:
+            try:
+                if old_path == path or time.time() - os.path.getmtime(old_path) > 3600:
+                    os.remove(old_path)
+            except OSError:
+                pass
+
+
+    def build_dataset(data_path, writers=None, size=(128, 128)):
+
+        # The label of an image is the position of its writer in 'writers' (default: the folder order)
+        writers = os.listdir(data_path) if writers is None else writers
+        labels = []
+
+        # Append the images to one raw uint8 file, decoding a bounded chunk at a time
+        folder, prefix = os.path.split(teacher.training_images)
+        os.makedirs(folder, exist_ok=True)
+        teacher.remove_training_images()
+
+        descriptor, path = tempfile.mkstemp(dir=folder, prefix=f'{prefix}-', suffix='.u8')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for writer_id, writer in enumerate(writers):
+                    writer_folder = os.path.join(data_path, writer)
+                    image_paths = [os.path.join(writer_folder, file_name) for file_name in os.listdir(writer_folder)]
+
+                    for start in range(0, len(image_paths), 256):
+                        for image in teacher.image_executor().map(partial(teacher.load_image, size=size),
+                                                                  image_paths[start:start + 256]):
+                            # Unreadable files are skipped like in teacher.load_images
+                            if image is not None:
+                                file.write(image.tobytes())
+                                labels.append(writer_id)
+
+            images = np.memmap(path, dtype=np.uint8, mode='r', shape=(len(labels), size[1], size[0]))
+
+        finally:
+            # The memory map stays readable without the file name, its pages are freed with the last reference
+            teacher.remove_training_images(path)
+
+        return writers, images, np.array(labels)
+
+
+    def normalize(images, normalization):
+        return (images[..., np.newaxis].astype(np.float32) - np.float32(normalization['mean'])) / np.float32(normalization['std'])
+
+
+    def batches(images, labels, indices, batch_size, shuffle=False, normalization=None):
+
+        import tensorflow as tf
+
+        normalization = normalization or teacher.normalization
+
+        def generate():
+            order = np.random.permutation(indices) if shuffle else indices
+
+            for start in range(0, len(order), batch_size):
+                # Sorted indices read the memory map front to back, the batch is normalized to float32 on its own
+                batch = np.sort(order[start:start + batch_size])
+                yield teacher.normalize(images[batch], normalization), labels[batch]
+
+        # The generator runs again for every epoch, so the training batches are reshuffled like model.fit does
+        signature = (tf.TensorSpec(shape=(None, *images.shape[1:], 1), dtype=tf.float32),
+                     tf.TensorSpec(shape=(None,), dtype=tf.int64))
+        return tf.data.Dataset.from_generator(generate, output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+
+    # Writer names in the order of the model's output classes, from the manifest of the model in use
+    def writers():
+        return model_registry.manifest()['writers']
+
+
+    def save_model(model, writers, accuracy, input_size=None, normalization=None):
+
+        # New model bundle with the labels and preprocessing of this training run, swapped in as a whole
+        return model_registry.save_bundle(model, {'writers': writers, 'input_size': list(input_size or teacher.input_size),
+                                                  'normalization': normalization or teacher.normalization,
+                                                  'accuracy': float(accuracy)})
+
+
+    # Runs in the training_job worker, progress(stage, epoch, epochs, metrics) reports every stage and epoch
+    def model_training(progress=training_job.log):
+
+        from sklearn.model_selection import train_test_split
+        from tensorflow.keras import layers, models
+
+        progress('Loading the images and labels')
+        writers, images, labels = teacher.build_dataset(os.path.join('Dataset','images'), size=teacher.input_size)
+
+        # Split the image indices into training and testing sets, the pixels stay in the memory map
+        progress('Splitting the dataset into training and testing sets')
+        train_indices, test_indices = train_test_split(np.arange(len(labels)), test_size=0.2, random_state=42)
+
+        batch_size = int(os.getenv('TRAIN_BATCH_SIZE', 32))
+        train_batches = teacher.batches(images, labels, train_indices, batch_size, shuffle=True)
+        test_batches = teacher.batches(images, labels, test_indices, batch_size)
+
+        # Define the CNN model architecture
+        progress('Define the CNN model architecture and compiling')
+        model = models.Sequential([
+            layers.Conv2D(32, (3, 3), activation='relu', input_shape=(teacher.input_size[1], teacher.input_size[0], 1)),
+            layers.MaxPooling2D((2, 2)),
+            layers.Conv2D(64, (3, 3), activation='relu'),
+            layers.MaxPooling2D((2, 2)),
+            layers.Flatten(),
+            layers.Dense(64, activation='relu'),
+            layers.Dense(len(writers), activation='softmax')
+        ])
+
+        # Compile the model
+        model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+
+        # Train the model
+        progress('Training the model')
+        model.fit(train_batches, epochs=10, validation_data=test_batches, verbose=0,
+                  callbacks=[training_job.keras_callback(progress, 'Training the model', 10)])
+
+        # Evaluate the model
+        progress('Evaluate the model')
+        loss, accuracy = model.evaluate(test_batches, verbose=0)
+
+        progress('Saving the model')
+        teacher.save_model(model, writers, accuracy)
+
+        return accuracy
+
+
+    def enroll_writer(student_id, progress=training_job.log):
+
+        from sklearn.model_selection import train_test_split
+        from tensorflow.keras import layers, models
+        from tensorflow.keras.models import load_model
+
+        # Add one writer to the trained model: the convolutional backbone is reused as it is
+        # and only the softmax head is trained, on backbone features computed once per image
+        # The preprocessing of the trained model's bundle is kept
+        manifest = model_registry.manifest()
+        writers = manifest['writers'] + [student_id]
+        width, height = manifest['input_size']
+        trained_model = load_model(manifest['path'])
+
+        progress('Loading the images and labels')
+        _, images, labels = teacher.build_dataset(os.path.join('Dataset','images'), writers, size=(width, height))
+        train_indices, test_indices = train_test_split(np.arange(len(labels)), test_size=0.2, random_state=42)
+
+        progress('Extracting the handwriting features')
+        backbone = models.Sequential([layers.Input(shape=(height, width, 1))] + trained_model.layers[:-1])
+        batch_size = int(os.getenv('TRAIN_BATCH_SIZE', 32))
+        features = backbone.predict(teacher.batches(images, labels, np.arange(len(labels)), batch_size,
+                                                    normalization=manifest['normalization']), verbose=0)
+
+        # New head with one more class, starting from the trained weights of the existing writers
+        progress('Training the classification head')
+        # Named, so it never clashes with a backbone layer's generated name in a fresh process
+        head = layers.Dense(len(writers), activation='softmax', name='writer_head')
+        head.build((None, features.shape[1]))
+
+        kernel, bias = head.get_weights()
+        trained_kernel, trained_bias = trained_model.layers[-1].get_weights()
+        kernel[:, :len(trained_bias)] = trained_kernel
+        bias[:len(trained_bias)] = trained_bias
+        head.set_weights([kernel, bias])
+
+        classifier = models.Sequential([layers.Input(shape=(features.shape[1],)), head])
+        classifier.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        classifier.fit(features[train_indices], labels[train_indices], epochs=30, batch_size=batch_size,
+                       validation_data=(features[test_indices], labels[test_indices]), verbose=0,
+                       callbacks=[training_job.keras_callback(progress, 'Training the classification head', 30)])
+        loss, accuracy = classifier.evaluate(features[test_indices], labels[test_indices], verbose=0)
+
+        progress('Saving the model')
+        model = models.Sequential([layers.Input(shape=(height, width, 1))] + trained_model.layers[:-1] + [head])
+        teacher.save_model(model, writers, accuracy, manifest['input_size'], manifest['normalization'])
+
+        return accuracy
+
+
+    def model():
+        try:
+            add_vertical_space(2)
+            col1, col2 = st.columns([0.5, 0.5])
+
+            with col1:
+                option = st.text_input(label='Please Enter the Student ID:')
+                add_vertical_space(1)
+                mode = st.radio(label='Training Mode', options=['Full Retraining', 'Enroll New Student', 'Enroll Centroid'],
+                                horizontal=True)
+                add_vertical_space(1)
+                submit = st.button(label='Submit ')
+
+            if submit and option != '':
+
+                if option in os.listdir(os.path.join('Dataset','images')):
+
+                    if mode == 'Full Retraining':
+                        add_vertical_space(2)
+                        teacher.start_training('full')
+
+                    elif not os.path.exists(model_registry.manifest()['path']):
+                        add_vertical_space(2)
+                        st.markdown(f'<h5 style="color: orange;">Trained Model is Required for Enrollment</h5>',
+                                    unsafe_allow_html=True)
+
+                    elif mode == 'Enroll Centroid':
+                        add_vertical_space(2)
+                        teacher.start_training('centroid', option)
+
+                    elif option in teacher.writers():
+                        add_vertical_space(2)
+                        st.markdown(f'<h5 style="color: orange;">{option} is already Enrolled in the Model</h5>',
+                                    unsafe_allow_html=True)
+
+                    else:
+                        add_vertical_space(2)
+                        teacher.start_training('enroll', option)
+
+                else:
+                    add_vertical_space(2)
+                    st.markdown(f'<h5 style="color: orange;">{option} Handwriting Samples are not available</h5>',
+                                unsafe_allow_html=True)
+
+            teacher.training_panel()
+
+        except ValueError:
+            add_vertical_space(1)
+            st.markdown(f'<h5 style="color: orange;">Handwriting Sample Images are required for Model Training</h5>',
+                        unsafe_allow_html=True)
+
+        except Exception as e:
+            add_vertical_space(1)
+            st.markdown(f'<h5 style="color: orange;">{e}</h5>', unsafe_allow_html=True)
+
+
+    def start_training(mode, student_id=None):
+
+        if training_job.start(mode, student_id) is None:
+            st.markdown(f'<h5 style="color: orange;">A Training Job is already Running, please wait for it to finish</h5>',
+                        unsafe_allow_html=True)
+        else:
+            st.markdown(f'<h5 style="color: green;">Training Job Started</h5>', unsafe_allow_html=True)
+
+
+    def training_panel():
+
+        # Only this panel polls a running job: a fragment rerun redraws it alone, the other tabs keep their queries
+        # and their widget input. Streamlit versions without fragments update it with the Refresh Status button.
+        status = training_job.status()
+        active = status is not None and status['state'] in ('queued', 'running')
 
-                    # Check Subfolders inside the concepts folder or not
-                    if len(os.listdir(os.path.join('Result','handwriting','matched','concepts')))==0:
-                        option = ['admin', 'teacher', 'student']
-                    else:
-                        option = ['admin', 'teacher', 'student'] +\
-                                [f'assistant - {i}' for i in os.listdir(os.path.join('Result','handwriting','matched','concepts'))] +\
-                                [f'supersub - {i}' for i in os.listdir(os.path.join('Result','handwriting','matched','concepts'))] + ['inactive']
+        fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
+        if fragment is None:
+            teacher.training_status()
+        else:
+            fragment(run_every=5 if active else None)(teacher.training_status)()
 
-                    # Get User Input 
-                    role = st.selectbox(label='Role ', options=option)
 
-            if update_user and password != '':
-                add_vertical_space(1)
-                sql.update_user_login_credentials_table(user_id, password, role)
+    def training_status():
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+        status = training_job.status()
+        if status is None:
+            return
 
+        active = status['state'] in ('queued', 'running')
+        color = 'orange' if status['state'] in ('failed', 'cancelled') else 'green'
+        titles = {'full': 'Full Retraining', 'enroll': f'Enroll {status["student_id"]}',
+                  'centroid': f'Enroll {status["student_id"]} Centroid' if status['student_id'] else 'Centroid Index'}
+        title = titles[status['mode']]
 
-    def get_role_delete_user(user_id):
+        add_vertical_space(1)
+        with st.expander(label='Training Job:', expanded=active):
+            st.markdown(f'<h5 style="color: {color};">{title}: {status["state"].title()} - {status["stage"]}</h5>',
+                        unsafe_allow_html=True)
+            st.write(f'Started: {status["started_at"]}' + (f', Finished: {status["finished_at"]}' if status['finished_at'] else ''))
 
-        connection = psycopg2.connect(host=os.getenv('HOST'),
-                                      user=os.getenv('USER'),
-                                      password=os.getenv('PASSWORD'),
-                                      database=os.getenv('DATABASE'))
-        cursor = connection.cursor()
+            if status['epochs']:
+                st.progress(status['epoch'] / status['epochs'], text=f'Epoch {status["epoch"]} / {status["epochs"]}')
 
-        cursor.execute(f'''select role from login_credentials
-                           where user_id = '{user_id}' 
-                           order by role;''')
+            if status['history']:
+                st.dataframe(pd.DataFrame(status['history']))
 
-        result = cursor.fetchall()
+            if status['accuracy'] is not None:
+                st.markdown(f'<h5 style="color: green;">Model Trained Successfully (Accuracy: {status["accuracy"]:.2%})</h5>',
+                            unsafe_allow_html=True)
 
-        role_list = [i[0] for i in result]
+            if status['error']:
+                st.markdown(f'<h5 style="color: orange;">{status["error"]}</h5>', unsafe_allow_html=True)
 
-        return role_list
+            if active:
+                col1, col2, _ = st.columns([0.25, 0.25, 0.5])
+                with col1:
+                    cancel = st.button(label='Cancel Training')
+                with col2:
+                    st.button(label='Refresh Status')
 
+                if cancel:
+                    training_job.cancel()
+                    st.experimental_rerun()
 
-    def delete_user():
 
+    def export_model():
         try:
-            add_vertical_space(1)
-            col10, col11 = st.columns([0.5, 0.5], gap='medium')
+            add_vertical_space(2)
+            col1, col2 = st.columns([0.5, 0.5])
 
-            with col10:
-                user_id = st.selectbox(label='User ID   ', options=sql.user_id())
+            with col1:
+                quantization = st.selectbox(label='Quantized Inference Model:', options=['float16', 'int8'])
                 add_vertical_space(1)
-                delete_user = st.button(label='Delete User')
+                export = st.button(label='Export')
+
+            if export:
                 add_vertical_space(1)
+                with st.spinner('Exporting the quantized model'):
+                    path = teacher.export_quantized(quantization)
 
-            with col11:
-                role = st.selectbox(label='Role   ', options=admin.get_role_delete_user(user_id))
+                st.markdown(f'<h5 style="color: green;">Exported {path} ({os.path.getsize(path) / 2 ** 20:.1f} MB)</h5>',
+                            unsafe_allow_html=True)
 
-            if delete_user:
-                add_vertical_space(1)
-                sql.delete_user_login_credentials_table(user_id, role=role)
+        except OSError:
+            add_vertical_space(1)
+            st.markdown(f'<h5 style="color: orange;">Trained Model is Required for Export</h5>', unsafe_allow_html=True)
 
         except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+            add_vertical_space(1)
+            st.markdown(f'<h5 style="color: orange;">{e}</h5>', unsafe_allow_html=True)
 
 
-    def main():
+    def preprocess_image(input_image, size=(128, 128)):
 
-        try:
-            user_id, login_status = admin.account_login(role='admin')
+        import cv2
 
-            if login_status == 'LogIn Successfully':
-                add_vertical_space(2)
+        image = Image.open(input_image)  # Image path or uploaded file
 
-                col1, col2, col3 = st.columns([0.1, 0.8, 0.1], gap='medium')
+        image_np = np.array(image.convert('L'))  # Convert to grayscale
 
-                with col2:
-                    tab1, tab2, tab3, tab4 = st.tabs(['View User', 'Add User', 'Update User', 'Delete User'])
+        return cv2.resize(image_np, size)  # Resize image to match model input shape
 
-                    with tab1:
-                        add_vertical_space(1)
-                        admin.view_user()
 
-                    with tab2:
-                        # Add Single User Data in SQL Table
-                        add_vertical_space(2)
-                        st.markdown(f'<h4 style="color:orange;">Add Single User:</h4>', unsafe_allow_html=True)
-                        admin.add_user()
+    def image_batches(input_images, batch_size, manifest=None):
 
-                        # Add Multiple Users Data in SQL Table
-                        add_vertical_space(2)
-                        st.markdown(f'<h4 style="color:orange;">Add Multiple Users:</h4>', unsafe_allow_html=True)
-                        admin.add_multiple_users()
+        # Input size and normalization of the model bundle
+        manifest = manifest or model_registry.manifest()
+        size = tuple(manifest['input_size'])
 
-                    with tab3:
-                        add_vertical_space(1)
-                        admin.update_user()
+        for start in range(0, len(input_images), batch_size):
 
-                    with tab4:
-                        add_vertical_space(1)
-                        admin.delete_user()
+            # Decode a batch of images into one float32 tensor (batch, height, width, 1) with normalized pixel values
+            batch = np.stack([teacher.preprocess_image(i, size) for i in input_images[start:start + batch_size]])
+            yield teacher.normalize(batch, manifest['normalization'])
 
-        except TypeError:
-            pass
 
+    def predict_writers(input_images, batch_size=64, backend='keras'):
 
+        # Predicted writer names. The weights, labels and preprocessing all come from one bundle,
+        # even when a training job swaps in a new one meanwhile
+        manifest = model_registry.manifest()
 
-class teacher:
+        # The training worker exports a new bundle right after saving it, until then its Keras model answers
+        if backend != 'keras' and os.path.exists(model_registry.tflite_path(backend, manifest)):
+            writer_ids = teacher.predict_writers_tflite(input_images, batch_size, backend, manifest)
 
-    # Function to load and preprocess images from a folder
-    def load_images(folder_path):
+        else:
+            model = model_registry.get(manifest)  # Trained model, loaded once per bundle
 
-        images = []
+            # One forward pass per batch
+            writer_ids = np.concatenate([np.argmax(model.predict_on_batch(batch), axis=1)
+                                         for batch in teacher.image_batches(input_images, batch_size, manifest)])
 
-        for file_name in os.listdir(folder_path):
+        return np.array(manifest['writers'])[writer_ids]
 
-            image_path = os.path.join(folder_path, file_name)
-            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
 
-            try:
-                image = cv2.resize(image, (128, 128))
-                images.append(image)
-            except:
-                pass
+    def export_quantized(quantization, manifest=None):
 
-        return images
+        import tensorflow as tf
 
+        # Quantized TFLite copy of the trained model for CPU inference, input and output stay float32
+        manifest = manifest or model_registry.manifest()
+        converter = tf.lite.TFLiteConverter.from_keras_model(model_registry.get(manifest))
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
 
-    def model_training():
+        if quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
 
-        with st.spinner('Loading the images and labels'):
+        else:
+            # int8 weights and activations, calibrated on up to 200 sample images. Only the sampled files are decoded
             data_path = os.path.join('Dataset','images')
+            image_paths = [os.path.join(data_path, writer, file_name) for writer in os.listdir(data_path)
+                           for file_name in os.listdir(os.path.join(data_path, writer))]
+            samples = np.random.default_rng(42).permutation(len(image_paths))[:200]
+            images = [teacher.load_image(image_paths[i], tuple(manifest['input_size'])) for i in samples]
 
-            writers = os.listdir(path=os.path.join('Dataset','images'))
-            images = []
-            labels = []
+            def representative_dataset():
+                for image in images:
+                    if image is not None:
+                        yield [teacher.normalize(image[np.newaxis], manifest['normalization'])]
 
-            for writer_id, writer in enumerate(writers):
-                writer_folder = os.path.join(data_path, writer)
+            converter.representative_dataset = representative_dataset
 
-                writer_images = teacher.load_images(writer_folder)
+        path = model_registry.tflite_path(quantization, manifest)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(converter.convert())
+        os.replace(temp_path, path)
 
-                images.extend(writer_images)
-                labels.extend([writer_id] * len(writer_images))
+        return path
 
-                # Convert images and labels to numpy arrays
-        with st.spinner('Converting images and labels to numpy arrays'):
-            images = np.array(images) / 255.0  # Normalize pixel values
-            labels = np.array(labels)
 
-            # Split dataset into training and testing sets
-            X_train, X_test, y_train, y_test = train_test_split(images, labels, test_size=0.2, random_state=42)
+    def predict_writers_tflite(input_images, batch_size, quantization, manifest):
 
-        # Define the CNN model architecture
-        with st.spinner('Define the CNN model architecture and compiling'):
-            model = models.Sequential([
-                layers.Conv2D(32, (3, 3), activation='relu', input_shape=(128, 128, 1)),
-                layers.MaxPooling2D((2, 2)),
-                layers.Conv2D(64, (3, 3), activation='relu'),
-                layers.MaxPooling2D((2, 2)),
-                layers.Flatten(),
-                layers.Dense(64, activation='relu'),
-                layers.Dense(len(writers), activation='softmax')
-            ])
-
-            # Compile the model
-            model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        runtime = model_registry.interpreter(quantization, manifest)
+        interpreter = runtime['interpreter']
 
-        # Train the model
-        with st.spinner('Training the model'):
-            model.fit(X_train, y_train, epochs=10, validation_data=(X_test, y_test))
+        writer_ids = []
+        for batch in teacher.image_batches(input_images, batch_size, manifest):
+            with runtime['lock']:
+                input_index = interpreter.get_input_details()[0]['index']
 
-        # Evaluate the model
-        with st.spinner('Evaluate the model'):
-            loss, accuracy = model.evaluate(X_test, y_test)
+                # The interpreter keeps the last batch shape, only a different size reallocates the tensors
+                if runtime['batch_size'] != len(batch):
+                    interpreter.resize_tensor_input(input_index, batch.shape)
+                    interpreter.allocate_tensors()
+                    runtime['batch_size'] = len(batch)
 
-            # Create the target folder if it doesn't exist
-            os.makedirs(r'Model', exist_ok=True)
+                interpreter.set_tensor(input_index, batch)
+                interpreter.invoke()
+                predictions = interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
 
-            # Save the trained model
-            model.save(os.path.join('Model','trained_model.h5'))
+            writer_ids.append(np.argmax(predictions, axis=1))
 
+        return np.concatenate(writer_ids)
 
-    def model():
-        try:
-            add_vertical_space(2)
-            col1, col2 = st.columns([0.5, 0.5])
 
-            with col1:
-                option = st.text_input(label='Please Enter the Student ID:')
-                add_vertical_space(1)
-                submit = st.button(label='Submit ')
+    # Nearest-centroid engine: a sheet matches when its handwriting embedding lies within the usual spread
+    # (radius) of the mean embedding (centroid) of the student it claims to be from
+    centroids_path = os.path.join('Model', 'centroids.npz')
 
-            if submit and option != '':
 
-                if option in os.listdir(os.path.join('Dataset','images')):
-                    add_vertical_space(2)
-                    teacher.model_training()
-                    st.markdown(f'<h5 style="color: green;">Model Trained Successfully</h5>', unsafe_allow_html=True)
+    def dataset_embeddings(writers):
 
-                else:
-                    add_vertical_space(2)
-                    st.markdown(f'<h5 style="color: orange;">{option} Handwriting Samples are not available</h5>',
-                                unsafe_allow_html=True)
+        # Backbone embeddings of the writers' sample images with their labels (positions in 'writers'),
+        # decoded one batch at a time from the sample cache, no dataset file is written
+        manifest = model_registry.manifest()
+        size = tuple(manifest['input_size'])
+        batch_size = int(os.getenv('TRAIN_BATCH_SIZE', 32))
 
-        except ValueError:
-            add_vertical_space(1)
-            st.markdown(f'<h5 style="color: orange;">Handwriting Sample Images are required for Model Training</h5>',
-                        unsafe_allow_html=True)
+        embeddings, labels = [], []
+        for writer_id, writer in enumerate(writers):
+            writer_folder = os.path.join('Dataset','images',writer)
+            image_paths = [os.path.join(writer_folder, file_name) for file_name in os.listdir(writer_folder)]
+
+            for start in range(0, len(image_paths), batch_size):
+                images = [image for image in teacher.image_executor().map(partial(teacher.load_image, size=size),
+                                                                          image_paths[start:start + batch_size])
+                          if image is not None]
+                if images:
+                    batch = teacher.normalize(np.stack(images), manifest['normalization'])
+                    embeddings.append(model_registry.backbone().predict_on_batch(batch))
+                    labels.extend([writer_id] * len(images))
+
+        # ValueError without any sample image, like teacher.build_dataset
+        return np.concatenate(embeddings), np.array(labels)
+
+
+    def writer_centroids(embeddings, labels, writer_count):
+
+        # Mean embedding per writer and the mean distance of the writer's samples to it
+        counts = np.bincount(labels, minlength=writer_count)[:, np.newaxis]
+        centroids = np.zeros((writer_count, embeddings.shape[1]), dtype=np.float32)
+        np.add.at(centroids, labels, embeddings)
+        centroids = centroids / np.maximum(counts, 1)
+
+        distances = np.linalg.norm(embeddings - centroids[labels], axis=1)
+        radius = np.bincount(labels, weights=distances, minlength=writer_count) / np.maximum(counts[:, 0], 1)
+
+        return centroids, radius.astype(np.float32)
 
-        except Exception as e:
-            add_vertical_space(1)
-            st.markdown(f'<h5 style="color: orange;">{e}</h5>', unsafe_allow_html=True)
 
+    def save_centroids(writers, centroids, radius):
 
-    def predict_writer(input_image):
+        os.makedirs(r'Model', exist_ok=True)
+
+        # Replace the index in one step so a running verification never reads a partial file
+        temp_path = f'{teacher.centroids_path}.{threading.get_ident()}.tmp.npz'
+        np.savez(temp_path, writers=np.array(writers), centroids=centroids.astype(np.float32),
+                 radius=radius.astype(np.float32), version=model_registry.backbone_version())
+        os.replace(temp_path, teacher.centroids_path)
+
+
+    def build_centroids():
+
+        writers = os.listdir(os.path.join('Dataset','images'))
+        embeddings, labels = teacher.dataset_embeddings(writers)
+        centroids, radius = teacher.writer_centroids(embeddings, labels, len(writers))
+
+        teacher.save_centroids(writers, centroids, radius)
+        return writers, centroids, radius
+
+
+    def centroid_index():
+
+        # None while the index is missing or was computed with another backbone, the training worker rebuilds it
         try:
-            os.makedirs(r'Model', exist_ok=True)  # Create the target folder if it doesn't exist
+            with np.load(teacher.centroids_path) as index:
+                if str(index['version']) == model_registry.backbone_version():
+                    return list(index['writers']), index['centroids'], index['radius']
 
-            model = load_model(os.path.join('Model','trained_model.h5'))  # Load the trained model
+        except FileNotFoundError:
+            pass
 
-            image = Image.open(input_image)  # Convert PIL image to BytesIO object
+        return None
 
-            image_np = np.array(image.convert('L'))  # Convert to grayscale
 
-            resized_image = cv2.resize(image_np, (128, 128))  # Resize image to match model input shape
+    # Runs in the training_job worker. Without a student, or without an index of the current backbone,
+    # the centroids of every writer are computed
+    def enroll_centroid(student_id=None, progress=training_job.log):
 
-            preprocessed_image = resized_image / 255.0  # Normalize pixel values
+        index = teacher.centroid_index()
+        if student_id is None or index is None:
+            progress('Computing the handwriting centroids of every student')
+            teacher.build_centroids()
+            return
 
-            input_data = np.expand_dims(preprocessed_image, axis=0)  # Add batch dimension
+        # Enrolling a student only computes the centroid of their sample images
+        progress(f'Computing the handwriting centroid of {student_id}')
+        writers, centroids, radius = index
+        embeddings, labels = teacher.dataset_embeddings([student_id])
+        centroid, spread = teacher.writer_centroids(embeddings, labels, 1)
 
-            predictions = model.predict(input_data)
+        if student_id in writers:
+            centroids[writers.index(student_id)], radius[writers.index(student_id)] = centroid[0], spread[0]
+        else:
+            writers.append(student_id)
+            centroids, radius = np.vstack([centroids, centroid]), np.concatenate([radius, spread])
 
-            writer_id = np.argmax(predictions)
+        teacher.save_centroids(writers, centroids, radius)
 
-            return writer_id
 
-        except OSError:
-            st.markdown(f'<h5 style="color:orange;">Trained Model is Required for Handwriting Verification</h5>',
-                        unsafe_allow_html=True)
+    def verify_writers(input_images, student_ids, batch_size=64):
 
-        except Exception as e:
-            st.markdown(f'<h5 style="color:orange;">{e}</h5>', unsafe_allow_html=True)
+        writers, centroids, radius = teacher.centroid_index()
+
+        embeddings = np.concatenate([model_registry.backbone().predict_on_batch(batch)
+                                     for batch in teacher.image_batches(input_images, batch_size)])
+
+        # Centroid row of the claimed student, students without a centroid never match
+        position = {writer: i for i, writer in enumerate(writers)}
+        rows = np.array([position.get(student_id, -1) for student_id in student_ids])
+        claimed = np.maximum(rows, 0)
+
+        # Distance of every sheet to its claimed centroid, in units of that student's radius, in one vectorized check
+        distance = np.linalg.norm(embeddings - centroids[claimed], axis=1) / np.maximum(radius[claimed], 1e-12)
+
+        return (rows >= 0) & (distance <= float(os.getenv('CENTROID_THRESHOLD', 1.75)))
 
 
     def handwriting_verification():
@@ -994,75 +3046,109 @@ class teacher:
             answer_sheet_images = st.file_uploader(label='Upload Answer Sheets:', type=['jpg', 'jpeg', 'png'],
                                                    accept_multiple_files=True)
 
+            # Answer sheets uploaded by assistants and supersubs wait in the 'teacher' area of the storage
+            include_uploaded = st.checkbox(label='Include Answer Sheets Uploaded by Assistants and Supersubs')
+
+            add_vertical_space(1)
+            engines = ['Classifier', 'Nearest Centroid']
+            engine = st.radio(label='Verification Engine', options=engines, horizontal=True,
+                              index=engines.index(os.getenv('VERIFICATION_ENGINE', 'Classifier')))
+
+            # Classifier backend: the float32 Keras model or a quantized TFLite export of it
+            backends = ['keras', 'float16', 'int8']
+            backend = st.selectbox(label='Classifier Backend', options=backends,
+                                   index=backends.index(os.getenv('INFERENCE_BACKEND', 'keras')))
+
             add_vertical_space(1)
             submit = st.form_submit_button(label='Submit')
             add_vertical_space(1)
 
-        if submit and answer_sheet_images != []:
+        stored_names, stored_paths = [], []
+        if submit and include_uploaded:
+            # Listed only on submit. Their blob paths are decoded one batch at a time in the prediction, like the uploaded files
+            uploaded_sheets = storage.files('teacher')
+            stored_names = list(uploaded_sheets['file_name'])
+            stored_paths = [storage.blob_path(blob) for blob in uploaded_sheets['blob']]
+
+        if submit and answer_sheet_images + stored_paths != []:
 
             add_vertical_space(1)
             with st.spinner('Verifying Handwriting...'):
 
-                for i, answer_sheet_image in enumerate(answer_sheet_images):
+                # Ex: ST01_machine learning_Q101.jpeg
+                answer_sheet_names = [answer_sheet_image.name for answer_sheet_image in answer_sheet_images] + stored_names
+                uploaded_count = len(answer_sheet_images)
+                answer_sheet_images = answer_sheet_images + stored_paths
+
+                # Get Student ID from Answer Sheet Name ---------------> [Ex: ST01, machine learning, Q101.jpeg] --> ST01
+                student_ids = np.array([answer_sheet_name.split('_')[0] for answer_sheet_name in answer_sheet_names])
 
-                    answer_sheet_name = answer_sheet_image.name  # Ex: ST01_machine learning_Q101.jpeg
+                batch_size = int(os.getenv('PREDICT_BATCH_SIZE', 64))
 
-                    # Get Student ID from Answer Sheet Name ---------------> [Ex: ST01, machine learning, Q101.jpeg] --> ST01
-                    student_id = answer_sheet_name.split('_')[0]
-                    concept = answer_sheet_name.split('_')[1]
+                try:
+                    if engine == 'Nearest Centroid' and teacher.centroid_index() is None:
+                        # The centroids of a new backbone are computed by the training worker, not in this request
+                        teacher.start_training('centroid')
+                        st.markdown(f'<h5 style="color:orange;">The Centroid Index is being Computed, please Verify again when the Training Job Finishes</h5>',
+                                    unsafe_allow_html=True)
+                        return
 
-                    # Predict the writer from the input image
-                    predicted_writer_id = teacher.predict_writer(answer_sheet_image)
+                    elif engine == 'Nearest Centroid':
+                        # Distance of every sheet to the centroid of its claimed student
+                        matched = teacher.verify_writers(answer_sheet_images, student_ids, batch_size=batch_size)
 
-                    # List of writer names corresponding to their IDs
-                    writer_names = os.listdir(os.path.join('Dataset','images'))
+                    else:
+                        # Predict the writers of all uploaded images with batched forward passes
+                        predicted_writers = teacher.predict_writers(answer_sheet_images, batch_size=batch_size,
+                                                                    backend=backend)
 
-                    # Get the predicted writer's name
-                    predicted_writer_name = writer_names[predicted_writer_id]
+                        # Compare the predicted writers with the actual writers
+                        matched = predicted_writers == student_ids
 
-                    # Compare the predicted writer with the actual writer
-                    if student_id == predicted_writer_name:
-                        img = Image.open(answer_sheet_image)
+                except OSError:
+                    st.markdown(f'<h5 style="color:orange;">Trained Model is Required for Handwriting Verification</h5>',
+                                unsafe_allow_html=True)
+                    return
 
-                        # Create the target folder if it doesn't exist
-                        os.makedirs(os.path.join('Result','handwriting','matched','concepts'), exist_ok=True)
-                        img.save(os.path.join('Result','handwriting','matched','concepts',concept,answer_sheet_name))
+                # The uploaded bytes as they are, stored as blobs of the matched or mismatched area
+                matched_files, mismatched_files = [], []
+                for answer_sheet_image, answer_sheet_name, is_matched in zip(answer_sheet_images[:uploaded_count],
+                                                                             answer_sheet_names, matched):
+                    files = matched_files if is_matched else mismatched_files
+                    files.append((answer_sheet_name, answer_sheet_image.getvalue()))
 
-                        # Create the student_id folder if it doesn't exist
-                        os.makedirs(os.path.join('Result','handwriting','matched','students',student_id), exist_ok=True)
-                        img.save(os.path.join('Result','handwriting','matched','students',student_id,answer_sheet_name))
+                matched_paths = storage.add('matched', matched_files)
+                storage.add('mismatched', mismatched_files)
 
-                    else:
-                        img = Image.open(answer_sheet_image)
+                # Verified sheets of the teacher area keep their blobs, only their index rows move
+                stored_matched = matched[uploaded_count:]
+                moved = storage.move('teacher', 'matched', [i for i, is_matched in zip(stored_names, stored_matched) if is_matched])
+                storage.move('teacher', 'mismatched', [i for i, is_matched in zip(stored_names, stored_matched) if not is_matched])
 
-                        # Create the target folder if it doesn't exist
-                        os.makedirs(os.path.join('Result','handwriting','mismatched'), exist_ok=True)   # os.path.join('Result','handwriting','mismatched')
-                        img.save(os.path.join('Result','handwriting','mismatched', answer_sheet_name))
+                matched_names = [answer_sheet_name for answer_sheet_name, _ in matched_files] + list(moved)
+                matched_paths = matched_paths + [storage.blob_path(blob) for blob in moved.values()]
 
-                # Create the target folder if it doesn't exist
-                os.makedirs(os.path.join('Result','handwriting','mismatched'), exist_ok=True)
+                # Evaluation previews, rendered in the background
+                for path in matched_paths:
+                    preview.executor().submit(preview.render, path)
 
-                # Make List for Mismatched Handwriting Images
-                mismatch_image_list = os.listdir(os.path.join('Result','handwriting','mismatched'))
+                # Matched sheets are queued for evaluation in one catalog insert
+                catalog.add([(answer_sheet_name.split('_')[1], answer_sheet_name, path)
+                             for answer_sheet_name, path in zip(matched_names, matched_paths)])
+
+                # Mismatched Handwriting Details from the storage index
+                mismatched_sheets = storage.files('mismatched')
 
                 # If All Images are Matched
-                if len(mismatch_image_list) == 0:
+                if len(mismatched_sheets) == 0:
                     st.markdown(
                         f'<h5 style="text-align: center;color: green;">All Answer Sheets are Handwriting Matched</h5>',
                         unsafe_allow_html=True)
 
                 else:
-                    mismatch_image_dict = {'user_id': [], 'concept': [], 'question_number': []}
-
-                    for i in mismatch_image_list:
-                        mismatched_user_id = i.split('_')[0]
-                        mismatched_concept = i.split('_')[1]
-                        mismatched_question_number = i.split('_')[2].split('.')[0]
-                        mismatch_image_dict['user_id'].append(mismatched_user_id)
-                        mismatch_image_dict['concept'].append(mismatched_concept)
-                        mismatch_image_dict['question_number'].append(mismatched_question_number)
-
-                    mismatch_image_df = pd.DataFrame(mismatch_image_dict)
+                    mismatch_image_df = pd.DataFrame({'user_id': mismatched_sheets['student_id'],
+                                                      'concept': mismatched_sheets['concept'],
+                                                      'question_number': 'Q' + mismatched_sheets['question_no'].astype(str)})
                     add_vertical_space(1)
                     st.markdown(f'<h5 style="color: orange;">Mismatched Handwriting Details:</h5>',
                                 unsafe_allow_html=True)
@@ -1072,13 +3158,10 @@ class teacher:
 
     def delete_data_test_qa_table():
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''delete from test_qa;''')
             connection.commit()
 
@@ -1087,10 +3170,9 @@ class teacher:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def test_qa_upload():
@@ -1102,74 +3184,57 @@ class teacher:
 
             with st.spinner('Uploading the Test QA...'):
 
-                # Verify the File Type for Reading method
-                if test_qa.name.endswith('.csv'):
-                    df = pd.read_csv(test_qa)
-
-                elif test_qa.name.endswith('.xlsx'):
-                    df = pd.read_excel(test_qa)
-
                 # Deleting the Previous QA Data from test_qa table
                 teacher.delete_data_test_qa_table()
 
-                # Uploading the New QA Data to test_qa table
-                sql.migrate_test_qa_table(df)
+                # Stream the New QA Data to test_qa table in chunks
+                sql.migrate_test_qa_table(sql.read_upload(test_qa))
 
 
     def user_id():
 
-        connection = psycopg2.connect(host=os.getenv('HOST'),
-                                      user=os.getenv('USER'),
-                                      password=os.getenv('PASSWORD'),
-                                      database=os.getenv('DATABASE'))
+        connection = sql.get_connection()
         cursor = connection.cursor()
 
-        cursor.execute(f'''select distinct user_id from login_credentials
-                           where role not in ('admin', 'teacher')
-                           order by user_id;''')
-
-        result = cursor.fetchall()
+        try:
+            cursor.execute(f'''select distinct user_id from login_credentials
+                               where role not in ('admin', 'teacher')
+                               order by user_id;''')
 
-        user_id = [i[0] for i in result]
+            result = cursor.fetchall()
 
-        return user_id
+            user_id = [i[0] for i in result]
 
+            return user_id
 
-    def view_user():
-        connection = psycopg2.connect(host=os.getenv('HOST'),
-                                      user=os.getenv('USER'),
-                                      password=os.getenv('PASSWORD'),
-                                      database=os.getenv('DATABASE'))
-        cursor = connection.cursor()
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
-        cursor.execute(f'''select user_id, role from login_credentials
-                           where role not in ('admin','teacher')
-                           order by user_id;''')
-        result = cursor.fetchall()
 
-        index = [i for i in range(1, len(result) + 1)]
-        columns = [i[0] for i in cursor.description]
+    def view_user():
 
-        df = pd.DataFrame(result, columns=columns, index=index)
-        df = df.rename_axis('s.no')
-        df = pd.DataFrame(df)
-        st.dataframe(df)
+        pagination.view(name='teacher_view_user',
+                        query=f'''select user_id, role from login_credentials
+                                   where role not in ('admin','teacher')''', params=[],
+                        sort_options={'User ID': ['user_id', 'role'], 'Role': ['role', 'user_id']})
 
 
     def update_user_role(user_id, role):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''update login_credentials
                                set role='{role}'
                                where user_id='{user_id}';''')
             connection.commit()
 
+            # Existing logins of this user must authenticate again
+            session.revoke_user(user_id)
+
             st.markdown(f'<h5 style="color: green;">User Role Updated Successfully</h5>', unsafe_allow_html=True)
             # Trigger a rerun to Refresh the Page
             st.experimental_rerun()
@@ -1179,10 +3244,9 @@ class teacher:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def update_user():
@@ -1197,532 +3261,292 @@ class teacher:
                     user_id = st.selectbox(label='User ID  ', options=teacher.user_id())
 
                 with col2:
-                    # Create the target folder if it doesn't exist
-                    os.makedirs(os.path.join('Result','handwriting','matched','concepts'), exist_ok=True)
+                    # Concepts with matched answer sheets in the catalog
+                    concepts = teacher.distinct_values('answer_sheet', 'concept')
 
-                    # Check Subfolders inside the concepts folder or not
-                    if len(os.listdir(os.path.join('Result','handwriting','matched','concepts')))==0:
+                    # Check Concepts in the catalog or not
+                    if len(concepts)==0:
                         option = ['admin', 'teacher', 'student']
                     else:
-                        option = ['student'] + [f'assistant - {i}' for i in os.listdir(os.path.join('Result','handwriting','matched','concepts'))] +\
-                                [f'supersub - {i}' for i in os.listdir(os.path.join('Result','handwriting','matched','concepts'))] + ['inactive']
+                        option = ['student'] + [f'assistant - {i}' for i in concepts] +\
+                                [f'supersub - {i}' for i in concepts] + ['inactive']
 
                     # Get User Input 
                     role = st.selectbox(label='Role  ', options=option)
 
                 add_vertical_space(1)
                 update_user = st.form_submit_button(label='Update User')
-                add_vertical_space(1)
-
-            if update_user:
-                add_vertical_space(1)
-                teacher.update_user_role(user_id, role)
-
-        except Exception as e:
-            add_vertical_space(1)
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-
-    def get_test_id_list():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select distinct test_id from student_test;''')
-            connection.commit()
-
-            result = cursor.fetchall()
-
-            if len(result) > 0:
-                df = pd.DataFrame(result)
-                df = df[0].to_list()
-                df.sort(reverse=False)
-                return df
-
-            else:
-                return []
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
-
-    def get_student_id_list_test():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select distinct student_id from student_test;''')
-            connection.commit()
-
-            result = cursor.fetchall()
-
-            if len(result) > 0:
-                df = pd.DataFrame(result)
-                df = df[0].to_list()
-                df.sort(reverse=False)
-                return df
-
-            else:
-                return []
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
-
-    def student_test_status():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select student_id, test_id, concept, sum(mark) as mark
-                            from student_test 
-                            group by student_id, test_id, concept
-                            order by test_id, concept asc, mark desc;''')
-            result = cursor.fetchall()
-
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
-
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
-
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
-
-    def filter_student_test_status(condition):
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select student_id, test_id, concept, sum(mark) as mark
-                               from student_test 
-                               where {condition} 
-                               group by student_id, test_id, concept
-                               order by test_id, concept asc, mark desc;''')
-            result = cursor.fetchall()
-
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
-
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+                add_vertical_space(1)
+
+            if update_user:
+                add_vertical_space(1)
+                teacher.update_user_role(user_id, role)
 
         except Exception as e:
+            add_vertical_space(1)
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
 
+    def query_distinct_values(table, column):
 
-    def get_exam_id_list():
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select distinct exam_id from student_exam;''')
-            connection.commit()
-
+            cursor.execute(f'''select distinct {column} from {table};''')
             result = cursor.fetchall()
 
-            if len(result) > 0:
-                df = pd.DataFrame(result)
-                exam_id_list = df[0].to_list()
-                exam_id_list.sort(reverse=False)
-                return exam_id_list
-
-            else:
-                return []
-
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+            values = [i[0] for i in result]
+            values.sort(reverse=False)
+            return values
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
-    def get_student_id_list_exam():
-
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+    def distinct_values(table, column):
 
-            cursor.execute(f'''select distinct student_id from student_exam;''')
-            connection.commit()
+        # Dropdown options, fetched at most once per write to the table
+        return cache.get(table, ('distinct', column), lambda: teacher.query_distinct_values(table, column))
 
-            result = cursor.fetchall()
 
-            if len(result) > 0:
-                df = pd.DataFrame(result)
-                df = df[0].to_list()
-                df.sort(reverse=False)
-                return df
+    def get_test_id_list():
 
-            else:
-                return []
+        try:
+            return teacher.distinct_values('student_test', 'test_id')
 
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
 
-    def student_exam_status():
+    def get_student_id_list_test():
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+            return teacher.distinct_values('student_test', 'student_id')
 
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, mark, evaluator_id
-                               from student_exam 
-                               group by student_id, exam_id, concept, question_no, mark, evaluator_id
-                               order by question_no, concept, exam_id asc, mark desc;''')
-            result = cursor.fetchall()
+        except Exception as e:
+            add_vertical_space(2)
+            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
 
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+    def student_test_status(test_id=None, student_id=None):
+
+        try:
+            filters, params = ['true'], []
+            if test_id is not None:
+                filters.append('test_id=%s')
+                params.append(test_id)
+            if student_id is not None:
+                filters.append('student_id=%s')
+                params.append(student_id)
+
+            # Every sort ends in the group by columns so the page keys are unique,
+            # the Mark sort has to aggregate all filtered rows before it can page
+            return pagination.view(name='teacher_student_test_status',
+                                   query=f'''select student_id, test_id, concept, coalesce(sum(mark), 0) as mark
+                                              from student_test
+                                              where {' and '.join(filters)}
+                                              group by student_id, test_id, concept''', params=params,
+                                   sort_options={'Test ID': ['test_id', 'student_id', 'concept'],
+                                                 'Student ID': ['student_id', 'test_id', 'concept'],
+                                                 'Mark': ['mark', 'test_id', 'concept', 'student_id']},
+                                   filters=(test_id, student_id))
 
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
 
-    def filter_student_exam_status(condition):
+    def get_exam_id_list():
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+            return teacher.distinct_values('student_exam', 'exam_id')
 
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, mark, evaluator_id
-                            from student_exam 
-                            where {condition}
-                            group by student_id, exam_id, concept, question_no, mark, evaluator_id
-                            order by question_no, concept, exam_id asc, mark desc;''')
-            result = cursor.fetchall()
+        except Exception as e:
+            add_vertical_space(2)
+            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
 
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+    def get_student_id_list_exam():
+
+        try:
+            return teacher.distinct_values('student_exam', 'student_id')
 
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
 
+    def exam_filters(exam_id=None, student_id=None):
 
-    def student_exam_status_average():
+        filters, params = ['true'], []
+        if exam_id is not None:
+            filters.append('exam_id=%s')
+            params.append(exam_id)
+        if student_id is not None:
+            filters.append('student_id=%s')
+            params.append(student_id)
+
+        return filters, params
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
 
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, avg(mark) as mark
-                               from student_exam 
-                               group by student_id, exam_id, concept, question_no
-                               order by exam_id, student_id, question_no asc;''')
+    def query_student_exam_analytics(exam_id=None, student_id=None, page=None):
+
+        connection = sql.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            filters, params = teacher.exam_filters(exam_id, student_id)
+
+            # page = (keys, first, last, descending) limits the groups to one page of question keys
+            if page is not None:
+                keys, first, last, descending = page
+                low, high = (last, first) if descending else (first, last)
+                placeholders = ', '.join(['%s'] * len(keys))
+                filters.append(f"({', '.join(keys)}) >= ({placeholders})")
+                filters.append(f"({', '.join(keys)}) <= ({placeholders})")
+                params.extend(low + high)
+
+            # One scan and one group by for all three tables: the first grouping set keeps the evaluator rows,
+            # the second one summarizes every question (summary=3 from grouping(evaluator_id, mark))
+            cursor.execute(f'''select student_id, exam_id, concept, question_no, mark, evaluator_id,
+                                      avg(mark) as average_mark, max(mark) as maximum_mark,
+                                      grouping(evaluator_id, mark) as summary
+                               from student_exam
+                               where {' and '.join(filters)}
+                               group by grouping sets ((student_id, exam_id, concept, question_no, mark, evaluator_id),
+                                                       (student_id, exam_id, concept, question_no));''', params)
             result = cursor.fetchall()
 
-            index = [i for i in range(1, len(result) + 1)]
             columns = [i[0] for i in cursor.description]
+            df = pd.DataFrame(result, columns=columns)
 
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+            detail = df[df['summary'] == 0][['student_id', 'exam_id', 'concept', 'question_no', 'mark', 'evaluator_id']]
+            detail = detail.astype({'mark': int})
+            summary = df[df['summary'] != 0]
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
+            if page is None:
+                detail = detail.sort_values(by=['question_no', 'concept', 'exam_id', 'mark'],
+                                            ascending=[True, True, True, False])
+                summary = summary.sort_values(by=['exam_id', 'student_id', 'question_no'])
+            else:
+                # Same order as the page keys
+                detail = detail.sort_values(by=keys + ['mark'], ascending=[not descending] * len(keys) + [False])
+                summary = summary.sort_values(by=keys, ascending=not descending)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            average = summary[['student_id', 'exam_id', 'concept', 'question_no', 'average_mark']].rename(columns={'average_mark': 'mark'})
+            maximum = summary[['student_id', 'exam_id', 'concept', 'question_no', 'maximum_mark']].rename(columns={'maximum_mark': 'mark'})
 
+            analytics = {}
+            for name, table in [('detail', detail), ('average', average), ('maximum', maximum)]:
+                table = table.reset_index(drop=True)
+                table.index = table.index + 1
+                analytics[name] = table.rename_axis('s.no')
 
-    def student_exam_status_maximum():
+            return analytics
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, max(mark) as mark
-                               from student_exam  
-                               group by student_id, exam_id, concept, question_no
-                               order by exam_id, student_id, question_no asc;''')
-            result = cursor.fetchall()
 
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
+    def student_exam_analytics(exam_id=None, student_id=None):
 
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+        # Cached per filter until the next write to student_exam
+        return cache.get('student_exam', ('analytics', exam_id, student_id),
+                         lambda: teacher.query_student_exam_analytics(exam_id, student_id))
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+    def query_student_exam_page(exam_id, student_id, keys, last_key, descending, limit):
 
+        # A page is `limit` questions (exam, student, concept, question_no); the analytics query
+        # then groups only the student_exam rows between the first and last question of the page
+        filters, params = teacher.exam_filters(exam_id, student_id)
+        groups, bounds, has_next = pagination.fetch(f'''select distinct student_id, exam_id, concept, question_no
+                                                       from student_exam
+                                                       where {' and '.join(filters)}''', params,
+                                                    keys, last_key, descending, limit)
 
-    def filter_student_exam_status_average(condition):
+        if bounds is None:
+            return None, None, False
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        analytics = teacher.query_student_exam_analytics(exam_id, student_id, page=(keys, bounds[0], bounds[1], descending))
+        return analytics, bounds, has_next
 
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, avg(mark) as mark
-                               from student_exam 
-                               where {condition}
-                               group by student_id, exam_id, concept, question_no
-                               order by exam_id, student_id, question_no asc;''')
-            result = cursor.fetchall()
 
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
+    def student_exam_page(exam_id, student_id, keys, last_key, descending, limit):
 
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+        # Cached per filter and page until the next write to student_exam
+        key = ('page', exam_id, student_id, tuple(keys), tuple(last_key or ()), descending, limit)
+        return cache.get('student_exam', key,
+                         lambda: teacher.query_student_exam_page(exam_id, student_id, keys, last_key, descending, limit))
 
-        except Exception as e:
-            add_vertical_space(2)
-            st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+    def student_exam_status(exam_id=None, student_id=None):
 
+        try:
+            keys, descending, limit, state = pagination.controls(
+                name='teacher_student_exam_status',
+                sort_options={'Exam ID': ['exam_id', 'student_id', 'concept', 'question_no'],
+                              'Student ID': ['student_id', 'exam_id', 'concept', 'question_no']},
+                filters=(exam_id, student_id))
 
-    def filter_student_exam_status_maximum(condition):
+            analytics, bounds, has_next = teacher.student_exam_page(exam_id, student_id, keys, state['cursors'][-1],
+                                                                    descending, limit)
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+            if analytics is None:
+                add_vertical_space(1)
+                st.markdown(f'<h5 style="color:orange;">No Records Found</h5>', unsafe_allow_html=True)
+                return
 
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, max(mark) as mark
-                               from student_exam  
-                               where {condition}
-                               group by student_id, exam_id, concept, question_no
-                               order by exam_id, student_id, question_no asc;''')
-            result = cursor.fetchall()
+            st.dataframe(analytics['detail'])
 
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
+            add_vertical_space(2)
+            st.markdown(f'<h5 style="color:orange;">Average Marks:</h5>', unsafe_allow_html=True)
+            st.dataframe(analytics['average'])
 
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            st.dataframe(df)
-            return df
+            add_vertical_space(2)
+            st.markdown(f'<h5 style="color:orange;">Maximum Marks:</h5>', unsafe_allow_html=True)
+            st.dataframe(analytics['maximum'])
+
+            pagination.navigation('teacher_student_exam_status', state, bounds, has_next)
 
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
 
     def migrate_student_exam_status_average(exam_id):
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, avg(mark) as mark
-                               from student_exam 
-                               where exam_id='{exam_id}' 
-                               group by student_id, exam_id, concept, question_no
-                               order by exam_id, student_id, question_no asc;''')
-            result = cursor.fetchall()
-
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
-
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            return df
+            return teacher.student_exam_analytics(exam_id=exam_id)['average']
 
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
 
     def migrate_student_exam_status_maximum(exam_id):
 
         try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
-
-            cursor.execute(f'''select student_id, exam_id, concept, question_no, max(mark) as mark
-                               from student_exam 
-                               where exam_id='{exam_id}'  
-                               group by student_id, exam_id, concept, question_no
-                               order by exam_id, student_id, question_no asc;''')
-            result = cursor.fetchall()
-
-            index = [i for i in range(1, len(result) + 1)]
-            columns = [i[0] for i in cursor.description]
-
-            df = pd.DataFrame(result, columns=columns, index=index)
-            df = df.rename_axis('s.no')
-            df = pd.DataFrame(df)
-            return df
+            return teacher.student_exam_analytics(exam_id=exam_id)['maximum']
 
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-        finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
-
 
     def update_answer_sheet_upload_portal(status):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''update status
                                set status='{status}'
                                where identifier='upload_portal';''')
@@ -1740,49 +3564,45 @@ class teacher:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def mark_delete_student_marks_table(exam_id):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''delete from student_marks
                                where exam_id='{exam_id}';''')
             connection.commit()
 
+            cache.invalidate('student_marks')
+
         except Exception as e:
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def migrate_student_marks_table(df, identifier, status):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
-            cursor.executemany(f'''insert into student_marks(student_id, exam_id, concept, question_no, mark) 
-                                   values(%s,%s,%s,%s,%s);''', df.values.tolist())
+        try:
+            sql.bulk_load(cursor, 'student_marks', ['student_id', 'exam_id', 'concept', 'question_no', 'mark'], df,
+                          key=['student_id', 'exam_id', 'concept', 'question_no'], update=True)
             connection.commit()
 
+            cache.invalidate('student_marks')
+
             # Update Status table
             sql.migrate_status_table(identifier, status)
 
@@ -1795,21 +3615,17 @@ class teacher:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def view_status_table():
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''select * from status;''')
             result = cursor.fetchall()
 
@@ -1827,10 +3643,9 @@ class teacher:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def marks_approval_status_update():
@@ -1883,24 +3698,20 @@ class teacher:
         add_vertical_space(2)
         st.markdown(f'<h4 style="color:green;">Student Test Status</h4>', unsafe_allow_html=True)
 
-        if len(teacher.get_test_id_list()) > 0:
+        test_id_list = teacher.get_test_id_list()
+
+        if len(test_id_list) > 0:
             col1, col2 = st.columns([0.5, 0.5], gap='medium')
             with col1:
-                test_options = ['Over All'] + teacher.get_test_id_list()
+                test_options = ['Over All'] + test_id_list
                 test_id = st.selectbox(label='Select Test ID', options=test_options)
             with col2:
                 student_id_options = ['Over All'] + teacher.get_student_id_list_test()
                 student_id = st.selectbox(label='Select Student ID', options=student_id_options)
 
             add_vertical_space(2)
-            if test_id == 'Over All' and student_id == 'Over All':
-                teacher.student_test_status()
-            elif test_id == 'Over All' and student_id != 'Over All':
-                teacher.filter_student_test_status(f"student_id='{student_id}'")
-            elif test_id != 'Over All' and student_id == 'Over All':
-                teacher.filter_student_test_status(f"test_id='{test_id}'")
-            elif test_id != 'Over All' and student_id != 'Over All':
-                teacher.filter_student_test_status(f"test_id='{test_id}' and student_id='{student_id}'")
+            teacher.student_test_status(test_id=None if test_id == 'Over All' else test_id,
+                                        student_id=None if student_id == 'Over All' else student_id)
 
         else:
             add_vertical_space(1)
@@ -1910,62 +3721,21 @@ class teacher:
         add_vertical_space(2)
         st.markdown(f'<h4 style="color:green;">Student Exam Status</h4>', unsafe_allow_html=True)
 
-        if len(teacher.get_exam_id_list()) > 0:
+        exam_id_list = teacher.get_exam_id_list()
+
+        if len(exam_id_list) > 0:
             col3, col4 = st.columns([0.5, 0.5], gap='medium')
             with col3:
-                exam_options = ['Over All'] + teacher.get_exam_id_list()
+                exam_options = ['Over All'] + exam_id_list
                 exam_id = st.selectbox(label='Select Exam ID', options=exam_options)
             with col4:
                 student_id_options = ['Over All'] + teacher.get_student_id_list_exam()
                 student_id = st.selectbox(label='Select Student ID ', options=student_id_options)
 
+            # Detail, Average and Maximum Marks from one analytics query
             add_vertical_space(2)
-            if exam_id == 'Over All' and student_id == 'Over All':
-                teacher.student_exam_status()
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Average Marks:</h5>', unsafe_allow_html=True)
-                teacher.student_exam_status_average()
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Maximum Marks:</h5>', unsafe_allow_html=True)
-                teacher.student_exam_status_maximum()
-
-
-            elif exam_id == 'Over All' and student_id != 'Over All':
-                teacher.filter_student_exam_status(f"student_id='{student_id}'")
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Average Marks:</h5>', unsafe_allow_html=True)
-                teacher.filter_student_exam_status_average(f"student_id='{student_id}'")
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Maximum Marks:</h5>', unsafe_allow_html=True)
-                teacher.filter_student_exam_status_maximum(f"student_id='{student_id}'")
-
-
-            elif exam_id != 'Over All' and student_id == 'Over All':
-                teacher.filter_student_exam_status(f"exam_id='{exam_id}'")
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Average Marks:</h5>', unsafe_allow_html=True)
-                teacher.filter_student_exam_status_average(f"exam_id='{exam_id}'")
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Maximum Marks:</h5>', unsafe_allow_html=True)
-                teacher.filter_student_exam_status_maximum(f"exam_id='{exam_id}'")
-
-
-            elif exam_id != 'Over All' and student_id != 'Over All':
-                teacher.filter_student_exam_status(f"exam_id='{exam_id}' and student_id='{student_id}'")
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Average Marks:</h5>', unsafe_allow_html=True)
-                teacher.filter_student_exam_status_average(f"exam_id='{exam_id}' and student_id='{student_id}'")
-
-                add_vertical_space(2)
-                st.markdown(f'<h5 style="color:orange;">Maximum Marks:</h5>', unsafe_allow_html=True)
-                teacher.filter_student_exam_status_maximum(f"exam_id='{exam_id}' and student_id='{student_id}'")
+            teacher.student_exam_status(exam_id=None if exam_id == 'Over All' else exam_id,
+                                        student_id=None if student_id == 'Over All' else student_id)
 
         else:
             add_vertical_space(1)
@@ -1995,6 +3765,12 @@ class teacher:
                          'Update Role', 'Student Status'])
                     with tab1:
                         teacher.model()
+                        teacher.export_model()
+
+                        # Model loaded by the registry
+                        add_vertical_space(1)
+                        with st.expander(label='Loaded Model:'):
+                            st.dataframe(pd.DataFrame(model_registry.info()))
 
                     with tab2:
                         teacher.handwriting_verification()
@@ -2022,13 +3798,10 @@ class student:
 
     def retrive_qa():
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''select * from test_qa;''')
 
             s = cursor.fetchall()
@@ -2045,23 +3818,18 @@ class student:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def student_test_status_verification(student_id, test_id):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
-            cursor.execute(f'''select * from student_test
-                            where student_id='{student_id}' and test_id='{test_id}';''')
+        try:
+            sql.execute_prepared(cursor, 'student_test_answers', (student_id, test_id))
             result = cursor.fetchall()
 
             index = [i for i in range(1, len(result) + 1)]
@@ -2077,10 +3845,9 @@ class student:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def test_id_and_question_selection(df):
@@ -2197,13 +3964,10 @@ class student:
 
     def student_test_status(student_id):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''select test_id, concept, sum(mark) as mark
                                from student_test
                                where student_id='{student_id}'
@@ -2228,21 +3992,17 @@ class student:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def student_exam_status(student_id):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''select * from student_marks
                                where student_id = '{student_id}';''')
             result = cursor.fetchall()
@@ -2264,10 +4024,9 @@ class student:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def main():
@@ -2328,32 +4087,34 @@ class supersub:
 
     def user_role_identification(user_id):
 
-        connection = psycopg2.connect(host=os.getenv('HOST'),
-                                      user=os.getenv('USER'),
-                                      password=os.getenv('PASSWORD'),
-                                      database=os.getenv('DATABASE'))
+        connection = sql.get_connection()
         cursor = connection.cursor()
 
-        cursor.execute(f'''select role from login_credentials
-                           where user_id='{user_id}';''')
-        result = cursor.fetchall()
+        try:
+            sql.execute_prepared(cursor, 'user_role', (user_id,))
+            result = cursor.fetchall()
+
+            return result[0][0]
 
-        return result[0][0]
+        finally:
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def update_student_exam_table(student_id, exam_id, question_no, concept, mark, evaluator_id):
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
+        try:
             cursor.execute(f'''insert into student_exam(student_id, exam_id, concept, question_no, mark, evaluator_id) 
                                values('{student_id}','{exam_id}','{concept}',{question_no},{mark},'{evaluator_id}');''')
             connection.commit()
 
+            # Cached exam analytics are stale from now on
+            cache.invalidate('student_exam')
+
             add_vertical_space(2)
             st.markdown(f'<h5 style="text-align:center; color:green;">Mark Updated Successfully</h5>',
                         unsafe_allow_html=True)
@@ -2369,17 +4130,16 @@ class supersub:
             st.markdown(f'<h5 style="text-align:center; color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
-    def display_answer_sheet(pending_evaluation_list, user_id, concept, evaluation_path):
+    def display_answer_sheet(file_name, answer_sheet, pending, user_id, concept):
 
         # Get Question Number from Answer Sheet Name ( ["ST01_sql_Q9.jpeg"] ------> 'Q9' )
 
-        question_number = pending_evaluation_list[0].split('.')[0].split('_')[2]
+        question_number = file_name.split('.')[0].split('_')[2]
 
         title_format = f"Answer Sheet: {concept} - {question_number}"
 
@@ -2387,26 +4147,23 @@ class supersub:
         add_vertical_space(1)
         col1, col2 = st.columns([0.7, 0.3], gap='medium')
         with col1:
-            answer_sheet = os.path.join(evaluation_path, pending_evaluation_list[0])
             st.markdown(f'<h5 style="color:orange;text-align:center">{title_format}</h5>', unsafe_allow_html=True)
         with col2:
             st.markdown(
-                f'<h5 style="color:orange;text-align:center">Pending Evaluation: {len(pending_evaluation_list)}</h5>',
+                f'<h5 style="color:orange;text-align:center">Pending Evaluation: {pending}</h5>',
                 unsafe_allow_html=True)
 
-        # Display the Resized Answer Sheet Images
+        # Display the WebP Preview of the Answer Sheet, the larger rendition when zoomed
         add_vertical_space(1)
-        img = Image.open(answer_sheet)
-        img_1 = img.resize((900, 900))
-        st.image(img_1, use_column_width=True)
+        zoom = st.checkbox(label='Zoom')
+        st.image(preview.load(answer_sheet, preview.widths[1] if zoom else preview.widths[0]), use_column_width=True)
 
-        # Save the Original Size Answer Sheet into Evaluation Folder
+        # Record the Answer Sheet as Evaluated, the image itself is never written again
         add_vertical_space(1)
         next_button = st.button(label='Next')
 
         if next_button:
-            evaluation_image_path = os.path.join('Result','evaluation',user_id,concept,pending_evaluation_list[0])
-            img.save(evaluation_image_path)
+            catalog.mark_evaluated(user_id, concept, file_name)
 
             # Trigger a rerun to Refresh the Page and Display the Next Answer Sheet
             st.experimental_rerun()
@@ -2451,30 +4208,17 @@ class supersub:
         # Find out the Concept of Supersub
         concept = user_role.split('-')[-1].strip()
 
-        # Create the target folder if it doesn't exist
-        os.makedirs(os.path.join('Result','evaluation',user_id,concept), exist_ok=True)
-        os.makedirs(os.path.join('Result','handwriting','matched','concepts'), exist_ok=True)
-
-        # Evaluted Answer Sheet List
-        evauated_answer_sheet_list = os.listdir(os.path.join('Result','evaluation',user_id,concept))
+        # Next sheets in question number order that this evaluator has not finished, from the catalog
+        sheets, pending = catalog.next_pending(user_id, concept, count=1 + int(os.getenv('PREVIEW_PREFETCH', 3)))
 
-        # Make Path to Access Answer Sheets
-        evaluation_path = os.path.join('Result','handwriting','matched','concepts',concept)
+        if len(sheets) > 0:
 
-        # Get a List of all Answer Sheet names and Sort by Question Number Ascending
-        answer_sheet_list = os.listdir(evaluation_path)
-        answer_sheet_list = sorted(answer_sheet_list,
-                                   key=lambda x: int(x.split('_')[-1].split('.')[0].replace('Q', '')))
+            file_name, student_id, question_no, answer_sheet = sheets[0]
 
-        # Compare Answer Sheet List with Evaluated Answer Sheet List
-        pending_evaluation_list = [i for i in answer_sheet_list if i not in evauated_answer_sheet_list]
+            supersub.display_answer_sheet(file_name, answer_sheet, pending, user_id, concept)
 
-        if len(pending_evaluation_list) > 0:
-
-            # Get Student ID from Answer Sheet Name ( ["ST01_sql_Q9.jpeg"] ------> 'ST01' )
-            student_id = pending_evaluation_list[0].split('.')[0].split('_')[0]
-
-            supersub.display_answer_sheet(pending_evaluation_list, user_id, concept, evaluation_path)
+            # Previews of the following sheets are in memory before Next is clicked
+            preview.prefetch([sheet[3] for sheet in sheets[1:]])
 
             supersub.mark_update_student_exam_table(student_id, concept, user_id)
 
@@ -2485,15 +4229,11 @@ class supersub:
 
     def check_upload_portal_status():
 
-        try:
-            connection = psycopg2.connect(host=os.getenv('HOST'),
-                                          user=os.getenv('USER'),
-                                          password=os.getenv('PASSWORD'),
-                                          database=os.getenv('DATABASE'))
-            cursor = connection.cursor()
+        connection = sql.get_connection()
+        cursor = connection.cursor()
 
-            cursor.execute(f'''select status from status
-                               where identifier='upload_portal';''')
+        try:
+            sql.execute_prepared(cursor, 'portal_status', ('upload_portal',))
 
             portal_status = cursor.fetchall()
 
@@ -2504,10 +4244,9 @@ class supersub:
             st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
         finally:
-            # close the connection
-            if connection:
-                cursor.close()
-                connection.close()
+            # return the connection to the pool
+            cursor.close()
+            sql.release_connection(connection)
 
 
     def upload_answer_sheet():
@@ -2524,11 +4263,8 @@ class supersub:
                 with col1:
                     student_id=st.text_input(label='Student ID')
                 with col2:
-                    # Create the target folder if it doesn't exist
-                    os.makedirs(os.path.join('Result','handwriting','matched','concepts'), exist_ok=True)
-                    os.makedirs(os.path.join('Result','handwriting','mismatched'), exist_ok=True)
-                    # User Select the Concept
-                    concept = st.selectbox(label="Select Concept", options=os.listdir(os.path.join('Result','handwriting','matched','concepts')))
+                    # User Select the Concept, one of the concepts with matched answer sheets
+                    concept = st.selectbox(label="Select Concept", options=teacher.distinct_values('answer_sheet', 'concept'))
                 with col3:
                     question_start = st.text_input(label="Question Start (Ex: 1)")
                 with col4:
@@ -2560,17 +4296,15 @@ class supersub:
                     # Answer Sheet and Question Numbers are Matched
                     if len(answer_sheet) == len(question_numbers):
 
+                        files = []
                         for i, uploaded_file in enumerate(answer_sheet):
                             question_number = question_numbers[i]
 
                             file_name = f"{student_id}_{concept}_Q{question_number}.{uploaded_file.type.split('/')[-1]}"
+                            files.append((file_name, uploaded_file.getvalue()))
 
-                            # Create the target folder if it doesn't exist
-                            os.makedirs(os.path.join('Result','teacher'), exist_ok=True)
-
-                            # save the answer sheet in file path
-                            img = Image.open(uploaded_file)
-                            img.save(os.path.join('Result','teacher',file_name))
+                        # save the uploaded bytes of the answer sheets in the teacher area of the storage
+                        storage.add('teacher', files)
 
                         add_vertical_space(2)
                         st.markdown(f'<h5 style="text-align:center; color:green;">Answer Sheet Uploaded Successfully</h5>', unsafe_allow_html=True)
@@ -2673,47 +4407,77 @@ class assistant(supersub):
 
 
 
-streamlit_config()
+if __name__ == '__main__' and sys.argv[1:2] == ['migrate']:
 
-with st.sidebar:
-    add_vertical_space(4)
-    option = option_menu(menu_title='',
-                         options=['Admin LogIn', 'Teacher LogIn', 'Assistant LogIn', 'Supersub LogIn', 'Student LogIn', 'Exit'],
-                         icons=['database-fill', 'globe', 'bar-chart-line', 'list-task', 'slash-square', 'sign-turn-right-fill'])
+    # Command line schema setup: python app.py migrate
+    for version, description in migration.run():
+        print(f'Applied migration {version}: {description}')
+
+    print(f'Schema is at version {migration.latest()}')
 
 
-if option == 'Admin LogIn':
+elif __name__ == '__main__' and sys.argv[1:2] == ['import-evaluations']:
 
-    # SQL database & table initialization setup
-    sql.main()
+    # Store and catalog the answer sheets and evaluation copies found in the Result folders, e.g. folders
+    # restored from a backup or written by an older version: python app.py import-evaluations
+    file_count, evaluation_count = catalog.import_folders()
 
-    admin.main()
+    print(f'Stored {file_count} new answer sheet files and imported {evaluation_count} evaluations')
 
 
-elif option == 'Teacher LogIn':
+elif __name__ == '__main__' and sys.argv[1:2] == ['train']:
 
-    teacher.main()
+    # Background training worker started by training_job.start: python app.py train <job id> full|enroll|centroid [student id]
+    sys.exit(training_job.run(*sys.argv[2:]))
 
 
-elif option == 'Student LogIn':
+elif __name__ == '__main__':
 
-    student.main()
+    streamlit_config()
 
+    # SQL database & table initialization setup (cached, applied once per server process)
+    try:
+        sql.main()
 
-elif option == 'Supersub LogIn':
+    except Exception as e:
+        add_vertical_space(2)
+        st.markdown(f'<h5 style="text-position:center;color:orange;">{e}</h5>', unsafe_allow_html=True)
 
-    supersub.main()
+    with st.sidebar:
+        add_vertical_space(4)
+        option = option_menu(menu_title='',
+                             options=['Admin LogIn', 'Teacher LogIn', 'Assistant LogIn', 'Supersub LogIn', 'Student LogIn', 'Exit'],
+                             icons=['database-fill', 'globe', 'bar-chart-line', 'list-task', 'slash-square', 'sign-turn-right-fill'])
 
 
-elif option == 'Assistant LogIn':
+    if option == 'Admin LogIn':
 
-    assistant.main()
+        admin.main()
 
 
-elif option == 'Exit':
+    elif option == 'Teacher LogIn':
+
+        teacher.main()
+
+
+    elif option == 'Student LogIn':
+
+        student.main()
 
-    add_vertical_space(1)
-    st.markdown(f'<h3 style="color:orange;text-align:center">Thank you for your time. Exiting the application</h3>',
-                unsafe_allow_html=True)
-    st.balloons()
 
+    elif option == 'Supersub LogIn':
+
+        supersub.main()
+
+
+    elif option == 'Assistant LogIn':
+
+        assistant.main()
+
+
+    elif option == 'Exit':
+
+        add_vertical_space(1)
+        st.markdown(f'<h3 style="color:orange;text-align:center">Thank you for your time. Exiting the application</h3>',
+                    unsafe_allow_html=True)
+        st.balloons()